@@ -0,0 +1,68 @@
+class ResolutionController:
+    """
+    keeps the frame time under the budget of target_fps by changing the number of rays
+    the frame time is smoothed and a change needs `patience` frames in a row outside the
+    hysteresis band, after a change nothing happens for `cooldown` frames
+    """
+    def __init__(self, rays_number: int, target_fps: float = 60, min_rays: int = 60,
+                 max_rays: int = 1000, step: int = 10, band: float = 0.15,
+                 smoothing: float = 0.1, patience: int = 15, cooldown: int = 30) -> None:
+        self.rays_number = rays_number
+        self._budget = 1 / target_fps
+        self._min_rays = min_rays
+        self._max_rays = max_rays
+        self._step = step
+        self._band = band
+        self._smoothing = smoothing
+        self._patience = patience
+        self._cooldown = cooldown
+        self._frame_time: float | None = None
+        self._over = 0
+        self._under = 0
+        self._wait = 0
+
+    def get_frame_time(self) -> float | None:
+        """
+        returns the smoothed frame time in seconds
+        """
+        return self._frame_time
+
+    def _quantize(self, n: float) -> int:
+        n = round(n / self._step) * self._step
+        return int(min(max(n, self._min_rays), self._max_rays))
+
+    def update(self, frame_time: float) -> int | None:
+        """
+        takes the time the last frame took to compute, without waiting for vsync or the clock
+        returns the new number of rays, or None if it should stay the same
+        """
+        if self._frame_time is None:
+            self._frame_time = frame_time
+        else:
+            self._frame_time += (frame_time - self._frame_time) * self._smoothing
+
+        if self._wait > 0:
+            self._wait -= 1
+            return None
+
+        load = self._frame_time / self._budget
+        self._over = self._over + 1 if load > 1 + self._band else 0
+        self._under = self._under + 1 if load < 1 - self._band else 0
+
+        # most of the frame scales with the number of rays, aim a bit under the budget
+        ideal = self.rays_number * (1 - self._band / 3) / load
+        new = self.rays_number
+        if self._over >= self._patience:
+            new = self._quantize(min(ideal, self.rays_number - self._step))
+        elif self._under >= self._patience:
+            # grow carefully, a too large step would overshoot and oscillate
+            new = self._quantize(min(ideal, self.rays_number * 1.25))
+
+        if new == self.rays_number:
+            return None
+        self.rays_number = new
+        self._over = 0
+        self._under = 0
+        self._wait = self._cooldown
+        self._frame_time = None
+        return new
@@ -0,0 +1,79 @@
+import numpy as np
+import importlib
+import constants
+import os
+
+
+TEXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "textures")
+
+
+class TextureAtlas:
+    """
+    all textures stacked into one (n_textures, res, res, 3) uint8 array
+    texture 0 is plain white and is used by walls without a texture
+    """
+    def __init__(self, directory: str = TEXTURES_DIR,
+                 res: int = constants.TEXTURE_RESOLUTION) -> None:
+        self._directory = directory
+        self._res = res
+        self._textures: list[np.ndarray] = [np.full((res, res, 3), 255, dtype=np.uint8)]
+        self._ids: dict[str, int] = {"": 0}
+        self._array: np.ndarray | None = None
+
+    def _load(self, name: str) -> np.ndarray:
+        """
+        reads a texture from the textures directory
+        .npy and raw rgb (.rgb) files are memory-mapped, python modules are a legacy fallback
+        """
+        shape = (self._res, self._res, 3)
+        path = os.path.join(self._directory, name)
+        if os.path.exists(path + ".npy"):
+            texture = np.load(path + ".npy", mmap_mode="r")
+        elif os.path.exists(path + ".rgb"):
+            texture = np.memmap(path + ".rgb", dtype=np.uint8, mode="r", shape=shape)
+        else:
+            try:
+                module = importlib.import_module(f"textures.{name}")
+            except ImportError as e:
+                raise FileNotFoundError(f"no such texture: {name}") from e
+            texture = np.array(module.texture, dtype=np.uint8)
+
+        if texture.size != self._res * self._res * 3:
+            raise ValueError(f"texture {name} is not {self._res}x{self._res} rgb")
+        return texture.reshape(shape)
+
+    def get_id(self, name: str | None) -> int:
+        """
+        returns id of the texture, loading it on first use
+        """
+        if not name:
+            return 0
+        if name not in self._ids:
+            self._textures.append(self._load(name))
+            self._ids[name] = len(self._textures) - 1
+            self._array = None
+        return self._ids[name]
+
+    def get_name(self, texture_id: int) -> str:
+        for name, i in self._ids.items():
+            if i == texture_id:
+                return name
+        raise KeyError(f"no texture with id {texture_id}")
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = np.stack(self._textures)
+        return self._array
+
+
+_ATLAS: TextureAtlas | None = None
+
+def get_atlas() -> TextureAtlas:
+    """
+    returns the atlas shared by all walls
+    """
+    global _ATLAS
+    if _ATLAS is None:
+        _ATLAS = TextureAtlas()
+    return _ATLAS
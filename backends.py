@@ -0,0 +1,382 @@
+from typing import Callable
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from shm_pool import SharedRayPool
+from spatial import WallGrid
+from dda import GridCaster
+import numpy as np
+import profiler
+import shapely
+import caster
+import time
+import os
+
+
+class Backend(ABC):
+    """
+    casts fans of rays against the current walls, all backends return the same hits
+    culls tells if the backend gets faster when given only the walls in view
+    """
+    name = "backend"
+    culls = False
+
+    @abstractmethod
+    def set_walls(self, walls: np.ndarray, index: WallGrid,
+                  grid_caster: GridCaster | None = None) -> None:
+        """
+        replaces the walls the rays are cast against
+        """
+
+    @abstractmethod
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        """
+        casts the rays, angles are in degrees
+        subset are indices of the only walls the rays can hit, backends that walk
+        the rays through space never test far walls anyway and may ignore it
+        """
+
+    def close(self) -> None:
+        pass
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class SerialBackend(Backend):
+    """
+    pure python, walks every ray through the buckets of the spatial index
+    no setup cost, wins on small maps and few rays
+    """
+    name = "serial"
+
+    def __init__(self, walls: np.ndarray, index: WallGrid) -> None:
+        self.set_walls(walls, index)
+
+    def set_walls(self, walls: np.ndarray, index: WallGrid,
+                  grid_caster: GridCaster | None = None) -> None:
+        self._walls = walls
+        self._index = index
+
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        angles = np.asarray(angles, dtype=np.float64)
+        sx = np.broadcast_to(np.asarray(starts_x, dtype=np.float64), angles.shape)
+        sy = np.broadcast_to(np.asarray(starts_y, dtype=np.float64), angles.shape)
+        hits = caster.empty_hits(len(angles))
+        hits.angle[:] = angles
+
+        tests = 0
+        for i, (x, y, angle) in enumerate(zip(sx.tolist(), sy.tolist(), angles.tolist())):
+            hit = self._index.cast(x, y, angle)
+            tests += self._index.last_tests
+            if hit is not None:
+                hits.x[i], hits.y[i], hits.wall[i], hits.dist[i] = hit
+        profiler.count("intersection_tests", tests)
+        hits.u[:] = caster.texture_u(hits.x, hits.y, hits.wall, self._walls)
+        return hits
+
+
+class NumpyBackend(Backend):
+    """
+    every ray against every wall in one broadcast operation on the calling thread
+    """
+    name = "numpy"
+    culls = True
+
+    def __init__(self, walls: np.ndarray, index: WallGrid | None = None) -> None:
+        self._walls = walls
+
+    def set_walls(self, walls: np.ndarray, index: WallGrid,
+                  grid_caster: GridCaster | None = None) -> None:
+        self._walls = walls
+
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        tested = len(self._walls) if subset is None else len(subset)
+        profiler.count("intersection_tests", len(angles) * tested)
+        return caster.cast_rays(starts_x, starts_y, angles, self._walls, subset)
+
+
+class DdaBackend(Backend):
+    """
+    walks the map grid, needs a grid caster built for the same walls
+    """
+    name = "dda"
+
+    def __init__(self, grid_caster: GridCaster) -> None:
+        self._grid_caster = grid_caster
+
+    def set_walls(self, walls: np.ndarray, index: WallGrid,
+                  grid_caster: GridCaster | None = None) -> None:
+        if grid_caster is None:
+            raise ValueError("dda engine needs a grid caster")
+        self._grid_caster = grid_caster
+
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        return self._grid_caster.cast_rays(starts_x, starts_y, angles)
+
+
+class ShapelyBackend(Backend):
+    """
+    geos does the work: an strtree over the walls finds candidate pairs for all rays at once,
+    intersections and distances are computed in single array calls that release the gil
+    """
+    name = "shapely"
+    culls = True
+
+    def __init__(self, walls: np.ndarray, index: WallGrid | None = None) -> None:
+        self.set_walls(walls, index)
+
+    def set_walls(self, walls: np.ndarray, index: WallGrid | None,
+                  grid_caster: GridCaster | None = None) -> None:
+        self._walls = walls
+        self._geoms = shapely.linestrings(walls.reshape(-1, 2, 2))
+        self._tree = shapely.STRtree(self._geoms)
+        lengths = np.hypot(walls[:, 2] - walls[:, 0], walls[:, 3] - walls[:, 1])
+        self._first_length = max(4 * float(np.median(lengths)), 1.0) if len(walls) else caster.RAY_LENGTH
+
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        angles = np.asarray(angles, dtype=np.float64)
+        sx = np.broadcast_to(np.asarray(starts_x, dtype=np.float64), angles.shape)
+        sy = np.broadcast_to(np.asarray(starts_y, dtype=np.float64), angles.shape)
+        n = len(angles)
+        hits = caster.empty_hits(n)
+        hits.angle[:] = angles
+        if n == 0 or len(self._walls) == 0:
+            return hits
+        allowed = None
+        if subset is not None:
+            allowed = np.zeros(len(self._walls), dtype=bool)
+            allowed[subset] = True
+
+        rad = np.radians(angles)
+        dx = np.cos(rad)
+        dy = np.sin(rad)
+        starts = shapely.points(sx, sy)
+
+        # a hit on the first part of a ray is its closest one, so rays start short and
+        # only the ones that missed are made longer, long rays would cross most of the map
+        active = np.arange(n)
+        length = self._first_length
+        while len(active):
+            length = min(length, caster.RAY_LENGTH)
+            coords = np.stack([np.stack([sx[active], sy[active]], axis=1),
+                               np.stack([sx[active] + dx[active] * length,
+                                         sy[active] + dy[active] * length], axis=1)], axis=1)
+            rays = shapely.linestrings(coords)
+            ray_ids, wall_ids = self._tree.query(rays, predicate="intersects")
+            if allowed is not None:
+                keep = allowed[wall_ids]
+                ray_ids = ray_ids[keep]
+                wall_ids = wall_ids[keep]
+            profiler.count("intersection_tests", len(ray_ids))
+
+            if len(ray_ids):
+                # collinear overlaps intersect as lines, the distance takes their nearest point
+                points = shapely.intersection(rays[ray_ids], self._geoms[wall_ids])
+                dist = shapely.distance(starts[active[ray_ids]], points)
+
+                # closest wall of every ray, ties go to the lower wall index like in caster
+                order = np.lexsort((wall_ids, dist, ray_ids))
+                first = order[np.r_[True, np.diff(ray_ids[order]) != 0]]
+                hit = active[ray_ids[first]]
+                hits.wall[hit] = wall_ids[first]
+                hits.dist[hit] = dist[first]
+                hits.x[hit] = sx[hit] + dx[hit] * dist[first]
+                hits.y[hit] = sy[hit] + dy[hit] * dist[first]
+                active = np.delete(active, ray_ids[first])
+
+            if length >= caster.RAY_LENGTH:
+                break
+            length *= 4
+
+        hits.u[:] = caster.texture_u(hits.x, hits.y, hits.wall, self._walls)
+        return hits
+
+
+class ThreadBackend(Backend):
+    """
+    splits the rays into chunks cast with numpy on a thread pool
+    numpy releases the gil in its loops, so the chunks run in parallel
+    """
+    culls = True
+
+    def __init__(self, walls: np.ndarray, index: WallGrid | None = None,
+                 max_workers: int | None = None, chunk_size: int = 64) -> None:
+        self._walls = walls
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.chunk_size = chunk_size
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                        thread_name_prefix="cast worker")
+
+    @property
+    def name(self) -> str:
+        return f"thread(workers={self.max_workers}, chunk={self.chunk_size})"
+
+    def set_walls(self, walls: np.ndarray, index: WallGrid,
+                  grid_caster: GridCaster | None = None) -> None:
+        self._walls = walls
+
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        angles = np.asarray(angles, dtype=np.float64)
+        sx = np.broadcast_to(np.asarray(starts_x, dtype=np.float64), angles.shape)
+        sy = np.broadcast_to(np.asarray(starts_y, dtype=np.float64), angles.shape)
+        walls = self._walls if subset is None else self._walls[subset]
+        chunks = [slice(i, i + self.chunk_size) for i in range(0, len(angles), self.chunk_size)]
+        futures = [self._pool.submit(caster.cast_rays, sx[c], sy[c], angles[c], walls)
+                   for c in chunks]
+
+        hits = caster.empty_hits(len(angles))
+        for c, future in zip(chunks, futures):
+            for out, part in zip(hits, future.result()):
+                out[c] = part
+        if subset is not None:
+            hit = hits.wall >= 0
+            hits.wall[hit] = subset[hits.wall[hit]]
+        profiler.count("intersection_tests", len(angles) * len(walls))
+        return hits
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+class ProcessBackend(Backend):
+    """
+    worker processes exchanging rays and hits through shared memory
+    pays off on big maps and many cores
+    """
+    def __init__(self, walls: np.ndarray, index: WallGrid | None = None,
+                 max_workers: int | None = None, chunk_size: int = 32) -> None:
+        self._pool = SharedRayPool(walls, index, max_workers=max_workers, chunk_size=chunk_size)
+        # workers walking the spatial index gain nothing from culling
+        self.culls = index is None
+
+    @property
+    def name(self) -> str:
+        return f"process(workers={self._pool.max_workers}, chunk={self._pool.chunk_size})"
+
+    @property
+    def chunk_size(self) -> int:
+        return self._pool.chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, chunk_size: int) -> None:
+        self._pool.chunk_size = chunk_size
+
+    def set_walls(self, walls: np.ndarray, index: WallGrid,
+                  grid_caster: GridCaster | None = None) -> None:
+        self._pool.set_walls(walls, index)
+        self.culls = index is None
+
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        if len(angles) == 0:
+            return caster.empty_hits(0)
+        with profiler.scope("pool"):
+            hits = self._pool.cast(starts_x, starts_y, angles, subset)
+
+        tasks = self._pool.last_tasks
+        profiler.count("intersection_tests", sum(task[0] for task in tasks))
+        if profiler.PROFILER.enabled:
+            for _, pid, start, end in tasks:
+                profiler.PROFILER.add_event("worker chunk", start, end, pid=pid, tid=0)
+        return hits
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+def create(engine: str, walls: np.ndarray, index: WallGrid,
+           grid_caster: GridCaster | None = None) -> Backend:
+    """
+    returns a new backend by engine name, "auto" is picked by calibrate instead
+    """
+    match engine:
+        case "numpy":
+            return NumpyBackend(walls)
+        case "serial":
+            return SerialBackend(walls, index)
+        case "shapely":
+            return ShapelyBackend(walls)
+        case "dda":
+            if grid_caster is None:
+                raise ValueError("dda engine needs a grid caster")
+            return DdaBackend(grid_caster)
+        case "thread":
+            return ThreadBackend(walls)
+        case "process":
+            # walls and index are shared with the workers once,
+            # rays and hits go through shared memory
+            return ProcessBackend(walls, index)
+    raise ValueError(f"unknown ray casting engine: {engine}")
+
+def _time_cast(backend: Backend, cast: Callable[[Backend, float], object], repeats: int) -> float:
+    """
+    returns the median time of casting the fan in a few directions, after a warm up cast
+    """
+    cast(backend, 0)
+    samples = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        cast(backend, i * 360 / repeats)
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+def _worker_counts(cpus: int) -> list[int]:
+    counts = []
+    n = cpus
+    while n >= 2 and len(counts) < 3:
+        counts.append(n)
+        n //= 2
+    return counts
+
+def _chunk_sizes(rays: int, workers: int) -> list[int]:
+    # one chunk per worker has the least overhead, smaller ones balance the load better
+    sizes = {max(1, -(-rays // workers)), max(1, -(-rays // (4 * workers))), 32}
+    return sorted(size for size in sizes if size <= rays)
+
+def calibrate(walls: np.ndarray, index: WallGrid, starts_x, starts_y, angles,
+              grid_caster: GridCaster | None = None, repeats: int = 4,
+              cpus: int | None = None,
+              cast: Callable[[Backend, float], object] | None = None
+              ) -> tuple[Backend, list[tuple[str, float]]]:
+    """
+    times every backend (and worker count and chunk size of the parallel ones)
+    on the given rays and returns the fastest one, open, with the timings of all candidates
+    cast(backend, turn) casts the rays turned by turn degrees the way the caller will,
+    so backends that cull are timed on the walls they will really get,
+    by default every backend casts against all walls
+    """
+    cpus = cpus or os.cpu_count() or 1
+    angles = np.asarray(angles, dtype=np.float64)
+    if cast is None:
+        def cast(backend: Backend, turn: float) -> object:
+            return backend.cast(starts_x, starts_y, angles + turn)
+    timings: list[tuple[str, float]] = []
+    candidates: list[Backend] = [SerialBackend(walls, index), NumpyBackend(walls),
+                                 ShapelyBackend(walls)]
+    if grid_caster is not None:
+        candidates.append(DdaBackend(grid_caster))
+
+    with profiler.scope("calibrate"):
+        # (time, backend, chunk size)
+        results: list[tuple[float, Backend, int | None]] = []
+        for backend in candidates:
+            results.append((_time_cast(backend, cast, repeats), backend, None))
+            timings.append((backend.name, results[-1][0]))
+
+        # chunk sizes are tried on the same pool, pools are only made per worker count
+        for workers in _worker_counts(cpus):
+            for kind in (ThreadBackend, ProcessBackend):
+                backend = kind(walls, index, max_workers=workers)
+                candidates.append(backend)
+                for size in _chunk_sizes(len(angles), workers):
+                    backend.chunk_size = size
+                    results.append((_time_cast(backend, cast, repeats),
+                                    backend, size))
+                    timings.append((backend.name, results[-1][0]))
+
+    _, best, chunk_size = min(results, key=lambda res: res[0])
+    if chunk_size is not None:
+        best.chunk_size = chunk_size
+    for backend in candidates:
+        if backend is not best:
+            backend.close()
+    return best, timings
@@ -0,0 +1,165 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame as pg
+from v2 import V2 as v2
+from player import Player
+from render import Renderer
+from dda import GridCaster
+import numpy as np
+import platform
+import argparse
+import constants
+import levels
+import draw
+import json
+import time
+import util
+import sys
+
+
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+DT = 1 / 60
+
+LEVELS = {
+    "default": lambda: levels.DEFAULT,
+    "medium": lambda: levels.generate(120, 60, seed=1),
+    "large": lambda: levels.generate(300, 150, seed=2),
+}
+
+# scripted camera paths, every step gets the frame number and the player
+PATHS = {
+    "idle": lambda i, p: None,
+    "spin": lambda i, p: p.rotate_right(1, DT),
+    "walk": lambda i, p: (p.move_forward(DT), p.rotate_right(0.3, DT)),
+    "strafe": lambda i, p: (p.move_right(DT) if i // 60 % 2 else p.move_left(DT),
+                            p.rotate_right(-0.5, DT)),
+}
+
+STAGES = ("cast", "collide", "render", "minimap")
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """
+    returns statistics of a list of timings in milliseconds
+    """
+    arr = np.array(samples) * 1000
+    return {
+        "mean": float(arr.mean()),
+        "median": float(np.median(arr)),
+        "p95": float(np.percentile(arr, 95)),
+        "max": float(arr.max()),
+    }
+
+def run(level_name: str, engine: str, rays: int, path: str, frames: int,
+        pipelined: bool = False) -> dict:
+    """
+    drives a player along a path and times every stage of every frame
+    when pipelined, cast is the time spent waiting for and starting the background cast
+    """
+    grid = LEVELS[level_name]()
+    level = util.load_map(grid, SCREEN_WIDTH, SCREEN_HEIGHT)
+    walls = level.lines()
+    grid_caster = None
+    if engine in ("dda", "auto"):
+        grid_caster = GridCaster(grid, SCREEN_WIDTH, SCREEN_HEIGHT, walls)
+    x, y = levels.spawn_point(grid, level.cell)
+
+    p = Player(v2(x, y), walls, fov=constants.FOV, rays_number=rays, r=30, speed=400,
+               rotation_speed=100, engine=engine, grid_caster=grid_caster, index=level.index,
+               normals=level.normals)
+    renderer = Renderer(SCREEN_WIDTH, SCREEN_HEIGHT, walls)
+    surface = pg.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    minimap_offset = v2(SCREEN_WIDTH * (1 - constants.MINIMAP_SCALE), 1)
+    timings: dict[str, list[float]] = {stage: [] for stage in STAGES}
+
+    try:
+        # first frame warms up worker processes and caches
+        p.cast_rays()
+        for i in range(frames):
+            PATHS[path](i, p)
+
+            if pipelined:
+                t0 = time.perf_counter()
+                p.collide(walls)
+                t1 = time.perf_counter()
+                p.finish_cast()
+                p.submit_cast()
+                t2 = time.perf_counter()
+                timings["collide"].append(t1 - t0)
+                timings["cast"].append(t2 - t1)
+            else:
+                t0 = time.perf_counter()
+                p.cast_rays()
+                t1 = time.perf_counter()
+                p.collide(walls)
+                t2 = time.perf_counter()
+                timings["cast"].append(t1 - t0)
+                timings["collide"].append(t2 - t1)
+            pos, angle = p.get_hits_pose()
+            renderer.draw(surface, p.get_rays_hits(), angle, (pos.x, pos.y))
+            t3 = time.perf_counter()
+            draw.draw_minimap(surface, walls, p, constants.MINIMAP_SCALE, minimap_offset)
+            t4 = time.perf_counter()
+
+            timings["render"].append(t3 - t2)
+            timings["minimap"].append(t4 - t3)
+    finally:
+        p.close()
+
+    frame = [sum(stage) for stage in zip(*timings.values())]
+    return {
+        "level": level_name,
+        "walls": len(walls),
+        "engine": engine,
+        "backend": str(p.get_backend()),
+        "rays": len(p.get_rays()),
+        "path": path,
+        "pipelined": pipelined,
+        "frames": frames,
+        "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+        "frame": summarize(frame),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="headless benchmark of the frame pipeline")
+    parser.add_argument("--levels", default=",".join(LEVELS))
+    parser.add_argument("--engines", default="numpy,dda,process")
+    parser.add_argument("--rays", default="60,250,1000")
+    parser.add_argument("--paths", default="walk")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--pipelined", action="store_true",
+                        help="cast the next frame in the background while drawing")
+    parser.add_argument("--output", help="file to write json results to, stdout by default")
+    args = parser.parse_args()
+
+    pg.init()
+    results = []
+    for level_name in args.levels.split(","):
+        for engine in args.engines.split(","):
+            for rays in (int(n) for n in args.rays.split(",")):
+                for path in args.paths.split(","):
+                    res = run(level_name, engine, rays, path, args.frames, args.pipelined)
+                    results.append(res)
+                    print(f"{level_name:>8} {engine:>8} {rays:>5} rays {path:>7}: "
+                          f"{res['frame']['mean']:7.2f} ms/frame ({res['backend']})", file=sys.stderr)
+    pg.quit()
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "screen": [SCREEN_WIDTH, SCREEN_HEIGHT],
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
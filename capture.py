@@ -0,0 +1,209 @@
+import pygame as pg
+import numpy as np
+import threading
+import profiler
+import queue
+import json
+import time
+import os
+
+
+# what to do with a frame when every buffer is still waiting for the disk
+DROP = "drop"
+BLOCK = "block"
+
+FORMATS = ("raw", "png", "npz")
+
+
+class FrameWriter:
+    """
+    writes (h, w, 3) uint8 rgb frames to a directory, runs on the recorder's thread
+    index is the number of the frame in the session, dropped frames leave gaps
+    """
+    format = ""
+
+    def __init__(self, directory: str, w: int, h: int, fps: float) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._w = w
+        self._h = h
+        self._fps = fps
+        self._indices: list[int] = []
+        self._times: list[float] = []
+
+    def write(self, index: int, t: float, frame: np.ndarray) -> None:
+        self._indices.append(index)
+        self._times.append(t)
+
+    def close(self, dropped: int) -> None:
+        """
+        writes the metadata, frame numbers and times of the written frames
+        """
+        np.save(os.path.join(self._directory, "index.npy"),
+                np.array(self._indices, dtype=np.int64))
+        np.save(os.path.join(self._directory, "times.npy"),
+                np.array(self._times, dtype=np.float64))
+        with open(os.path.join(self._directory, "meta.json"), "w") as f:
+            json.dump({"format": self.format, "size": [self._w, self._h], "fps": self._fps,
+                       "frames": len(self._indices), "dropped": dropped}, f)
+
+
+class RawWriter(FrameWriter):
+    """
+    appends the frames to one raw rgb24 video,
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r FPS -i frames.rgb encodes it
+    """
+    format = "raw"
+
+    def __init__(self, directory: str, w: int, h: int, fps: float) -> None:
+        super().__init__(directory, w, h, fps)
+        self._file = open(os.path.join(directory, "frames.rgb"), "wb")
+
+    def write(self, index: int, t: float, frame: np.ndarray) -> None:
+        self._file.write(frame.data)
+        super().write(index, t, frame)
+
+    def close(self, dropped: int) -> None:
+        self._file.close()
+        super().close(dropped)
+
+
+class PngWriter(FrameWriter):
+    """
+    saves every frame as its own png, named by its frame number
+    """
+    format = "png"
+
+    def write(self, index: int, t: float, frame: np.ndarray) -> None:
+        image = pg.image.frombuffer(frame.data, (self._w, self._h), "RGB")
+        pg.image.save(image, os.path.join(self._directory, f"frame_{index:06d}.png"))
+        super().write(index, t, frame)
+
+
+class NpzWriter(FrameWriter):
+    """
+    collects chunk frames at a time and stores them compressed in one .npz,
+    with their frame numbers and times
+    """
+    format = "npz"
+
+    def __init__(self, directory: str, w: int, h: int, fps: float, chunk: int = 60) -> None:
+        super().__init__(directory, w, h, fps)
+        self._chunk = np.empty((chunk, h, w, 3), dtype=np.uint8)
+        self._filled = 0
+        self._chunks = 0
+
+    def write(self, index: int, t: float, frame: np.ndarray) -> None:
+        self._chunk[self._filled] = frame
+        self._filled += 1
+        super().write(index, t, frame)
+        if self._filled == len(self._chunk):
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._filled == 0:
+            return
+        np.savez_compressed(os.path.join(self._directory, f"chunk_{self._chunks:05d}.npz"),
+                            frames=self._chunk[:self._filled],
+                            index=np.array(self._indices[-self._filled:], dtype=np.int64),
+                            times=np.array(self._times[-self._filled:], dtype=np.float64))
+        self._chunks += 1
+        self._filled = 0
+
+    def close(self, dropped: int) -> None:
+        self._flush()
+        super().close(dropped)
+
+
+def make_writer(fmt: str, directory: str, w: int, h: int, fps: float) -> FrameWriter:
+    match fmt:
+        case "raw":
+            return RawWriter(directory, w, h, fps)
+        case "png":
+            return PngWriter(directory, w, h, fps)
+        case "npz":
+            return NpzWriter(directory, w, h, fps)
+    raise ValueError(f"unknown capture format: {fmt}")
+
+
+class Recorder:
+    """
+    copies frames into a fixed set of buffers and writes them on a background thread
+    at most `buffers` frames are held in memory, when all of them are waiting for the disk
+    the frame is dropped (policy DROP) or submit waits for a free buffer (policy BLOCK)
+    """
+    def __init__(self, writer: FrameWriter, w: int, h: int, buffers: int = 8,
+                 policy: str = DROP) -> None:
+        if policy not in (DROP, BLOCK):
+            raise ValueError(f"unknown capture policy: {policy}")
+        self._writer = writer
+        self._w = w
+        self._h = h
+        self._policy = policy
+        self._buffers = np.empty((buffers, h, w, 3), dtype=np.uint8)
+        self._free: queue.Queue[int] = queue.Queue()
+        for i in range(buffers):
+            self._free.put(i)
+        self._queue: queue.Queue[tuple[int, int, float] | None] = queue.Queue()
+        self._error: BaseException | None = None
+        self._index = 0
+        self.written = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="capture writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while (item := self._queue.get()) is not None:
+            buffer, index, t = item
+            try:
+                if self._error is None:
+                    with profiler.scope("capture write"):
+                        self._writer.write(index, t, self._buffers[buffer])
+                    self.written += 1
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._free.put(buffer)
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("capture writer failed") from self._error
+
+    def submit(self, frame: pg.Surface | np.ndarray) -> bool:
+        """
+        queues a copy of the frame, a surface or an (h, w, 3) uint8 rgb array
+        returns False if the frame was dropped
+        """
+        self._check()
+        index = self._index
+        self._index += 1
+        try:
+            buffer = self._free.get(block=self._policy == BLOCK)
+        except queue.Empty:
+            self.dropped += 1
+            profiler.count("frames_dropped")
+            return False
+
+        try:
+            with profiler.scope("capture copy"):
+                if isinstance(frame, pg.Surface):
+                    # surfarray is indexed (x, y)
+                    pixels = pg.surfarray.pixels3d(frame)
+                    self._buffers[buffer] = pixels.swapaxes(0, 1)
+                    del pixels
+                else:
+                    self._buffers[buffer] = frame
+        except BaseException:
+            self._free.put(buffer)
+            raise
+        self._queue.put((buffer, index, time.perf_counter()))
+        return True
+
+    def close(self) -> None:
+        """
+        writes the frames still queued and finishes the recording
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close(self.dropped)
+        self._check()
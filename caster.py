@@ -0,0 +1,132 @@
+from typing import NamedTuple
+import numpy as np
+
+
+# rays are cast as segments of this length, same as the worker pool does
+RAY_LENGTH = 10000.0
+
+# upper bound for the rays x walls temporaries of a single block
+_MAX_BLOCK_ELEMENTS = 1 << 20
+
+
+class Hits(NamedTuple):
+    """
+    result of casting a fan of rays, one entry per ray
+    rays that didnt hit anything have wall == -1 and dist == inf
+    """
+    angle: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    wall: np.ndarray
+    dist: np.ndarray
+    u: np.ndarray
+
+
+def walls_to_array(walls) -> np.ndarray:
+    """
+    converts a list of lines to an (n, 4) array of x1, y1, x2, y2
+    """
+    arr = np.empty((len(walls), 4), dtype=np.float64)
+    for i, w in enumerate(walls):
+        arr[i] = (w.start.x, w.start.y, w.end.x, w.end.y)
+    return arr
+
+def intersect_ray_segment(x1, y1, x2, y2, x3, y3, x4, y4):
+    # robust parametric intersection (ray from p1->p2 vs segment p3->p4)
+    denom = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
+    if abs(denom) < 1e-9:
+        return None
+    t = ((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4)) / denom
+    u = -((x1 - x2) * (y1 - y3) - (y1 - y2) * (x1 - x3)) / denom
+    if t < 0.0 or t > 1.0 or u < 0.0 or u > 1.0:
+        return None
+    ix = x1 + t * (x2 - x1)
+    iy = y1 + t * (y2 - y1)
+    return (ix, iy)
+
+def empty_hits(n: int) -> Hits:
+    return Hits(np.zeros(n), np.zeros(n), np.zeros(n),
+                np.full(n, -1, dtype=np.intp), np.full(n, np.inf), np.zeros(n))
+
+def texture_u(x: np.ndarray, y: np.ndarray, wall: np.ndarray, walls: np.ndarray) -> np.ndarray:
+    """
+    returns position of each hit along its wall, from 0 at the start to 1 at the end
+    """
+    if len(walls) == 0:
+        # nothing can be hit without walls, e.g. outside of the streamed chunks
+        return np.zeros(len(wall))
+    w = walls[np.maximum(wall, 0)]
+    length = np.hypot(w[:, 2] - w[:, 0], w[:, 3] - w[:, 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u = np.hypot(x - w[:, 0], y - w[:, 1]) / length
+    return np.where(wall >= 0, np.clip(np.nan_to_num(u), 0.0, 1.0), 0.0)
+
+def _cast_block(sx: np.ndarray, sy: np.ndarray, dx: np.ndarray, dy: np.ndarray,
+                walls: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    casts a block of rays against every wall
+    returns index of the closest wall (-1 if none) and the ray parameter of the hit
+    """
+    x3 = walls[:, 0][None, :]
+    y3 = walls[:, 1][None, :]
+    x4 = walls[:, 2][None, :]
+    y4 = walls[:, 3][None, :]
+    sx = sx[:, None]
+    sy = sy[:, None]
+    dx = dx[:, None]
+    dy = dy[:, None]
+
+    # same parametric form as intersect_ray_segment with p2 - p1 = d
+    denom = dy * (x3 - x4) - dx * (y3 - y4)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = ((sx - x3) * (y3 - y4) - (sy - y3) * (x3 - x4)) / denom
+        u = (dx * (sy - y3) - dy * (sx - x3)) / denom
+
+    valid = (np.abs(denom) >= 1e-9) & (t >= 0.0) & (t <= 1.0) & (u >= 0.0) & (u <= 1.0)
+    t = np.where(valid, t, np.inf)
+
+    idx = np.argmin(t, axis=1)
+    best = t[np.arange(len(idx)), idx]
+    idx[~np.isfinite(best)] = -1
+    return idx, best
+
+def cast_rays(starts_x, starts_y, angles, walls: np.ndarray,
+              subset: np.ndarray | None = None) -> Hits:
+    """
+    casts every ray against every wall in one batched operation
+    angles are in degrees, walls is an (n, 4) array from walls_to_array
+    subset limits the walls tested to the given indices, hits still use indices into walls
+    """
+    if subset is not None:
+        hits = cast_rays(starts_x, starts_y, angles, walls[subset])
+        hit = hits.wall >= 0
+        hits.wall[hit] = subset[hits.wall[hit]]
+        return hits
+
+    angles = np.asarray(angles, dtype=np.float64)
+    sx = np.broadcast_to(np.asarray(starts_x, dtype=np.float64), angles.shape)
+    sy = np.broadcast_to(np.asarray(starts_y, dtype=np.float64), angles.shape)
+    n = len(angles)
+
+    if n == 0 or len(walls) == 0:
+        hits = empty_hits(n)
+        hits.angle[:] = angles
+        return hits
+
+    rad = np.radians(angles)
+    dx = np.cos(rad) * RAY_LENGTH
+    dy = np.sin(rad) * RAY_LENGTH
+
+    idx = np.empty(n, dtype=np.intp)
+    t = np.empty(n, dtype=np.float64)
+    block = max(1, _MAX_BLOCK_ELEMENTS // len(walls))
+    for i in range(0, n, block):
+        j = i + block
+        idx[i:j], t[i:j] = _cast_block(sx[i:j], sy[i:j], dx[i:j], dy[i:j], walls)
+
+    hit = idx >= 0
+    t[~hit] = 0.0
+    x = np.where(hit, sx + t * dx, 0.0)
+    y = np.where(hit, sy + t * dy, 0.0)
+    dist = np.where(hit, t * RAY_LENGTH, np.inf)
+    return Hits(angles, x, y, idx, dist, texture_u(x, y, idx, walls))
@@ -0,0 +1,65 @@
+from spatial import WallGrid
+import numpy as np
+import math
+
+
+def distances(x: float, y: float, walls: np.ndarray) -> np.ndarray:
+    """
+    returns distance from the point to the closest point of every wall
+    """
+    x1 = walls[:, 0]
+    y1 = walls[:, 1]
+    ex = walls[:, 2] - x1
+    ey = walls[:, 3] - y1
+    length2 = ex * ex + ey * ey
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = ((x - x1) * ex + (y - y1) * ey) / length2
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+    return np.hypot(x1 + t * ex - x, y1 + t * ey - y)
+
+def _push_out_of_wall(x: float, y: float, r: float,
+                      x1: float, y1: float, x2: float, y2: float) -> tuple[float, float]:
+    """
+    moves the circle along the normal of the wall's closest point until they only touch
+    """
+    ex = x2 - x1
+    ey = y2 - y1
+    length2 = ex * ex + ey * ey
+    t = ((x - x1) * ex + (y - y1) * ey) / length2 if length2 > 0 else 0.0
+    t = min(max(t, 0.0), 1.0)
+    dx = x - (x1 + t * ex)
+    dy = y - (y1 + t * ey)
+    d = math.hypot(dx, dy)
+    if d >= r or d == 0:
+        return x, y
+    amt = (r - d) / d
+    return x + dx * amt, y + dy * amt
+
+def push_out(x: float, y: float, r: float, walls: np.ndarray,
+             candidates: list[int] | None = None) -> tuple[float, float]:
+    """
+    resolves overlaps of a circle with the walls and returns the new center
+    candidates are indices of the walls to test (all walls if None),
+    overlapping walls are resolved one by one in index order
+    """
+    if candidates is None:
+        candidates = list(range(len(walls)))
+    if not candidates:
+        return x, y
+
+    # narrow phase, usually nothing touches and we are done
+    touching = distances(x, y, walls[candidates]) < r
+    if not touching.any():
+        return x, y
+
+    first = int(np.argmax(touching))
+    for i in candidates[first:]:
+        x, y = _push_out_of_wall(x, y, r, *walls[i].tolist())
+    return x, y
+
+def resolve(x: float, y: float, r: float, walls: np.ndarray,
+            index: WallGrid) -> tuple[float, float]:
+    """
+    same as push_out, but only walls from the index buckets around the circle are tested
+    """
+    return push_out(x, y, r, walls, index.query_radius(x, y, r))
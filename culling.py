@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def facing(walls: np.ndarray, normals: np.ndarray, x: float, y: float) -> np.ndarray:
+    """
+    returns mask of the walls whose front side (the side their normal points to) faces the point
+    """
+    return (x - walls[:, 0]) * normals[:, 0] + (y - walls[:, 1]) * normals[:, 1] > 0
+
+def in_view(walls: np.ndarray, x: float, y: float, angle: float, fov: float) -> np.ndarray:
+    """
+    returns mask of the walls that overlap the view wedge from (x, y), angles are in degrees
+    exact separating axis test of every segment against the wedge, so no visible wall is lost
+    """
+    if fov >= 180:
+        # the wedge is not convex anymore, only walls fully behind the player could go
+        return np.ones(len(walls), dtype=bool)
+
+    left = np.radians(angle - fov / 2)
+    right = np.radians(angle + fov / 2)
+    lx, ly = np.cos(left), np.sin(left)
+    rx, ry = np.cos(right), np.sin(right)
+    ax = walls[:, 0] - x
+    ay = walls[:, 1] - y
+    bx = walls[:, 2] - x
+    by = walls[:, 3] - y
+
+    # both ends outside the same edge of the wedge
+    outside_left = (lx * ay - ly * ax < 0) & (lx * by - ly * bx < 0)
+    outside_right = (rx * ay - ry * ax > 0) & (rx * by - ry * bx > 0)
+
+    # the whole wedge on one side of the wall's line: the player is on that side
+    # and neither edge of the wedge turns towards the line
+    ex = bx - ax
+    ey = by - ay
+    side = ex * -ay - ey * -ax
+    towards_left = ex * ly - ey * lx
+    towards_right = ex * ry - ey * rx
+    beside = (side != 0) & (side * towards_left >= 0) & (side * towards_right >= 0)
+
+    return ~(outside_left | outside_right | beside)
+
+def visible_walls(walls: np.ndarray, normals: np.ndarray | None, x: float, y: float,
+                  angle: float, fov: float, margin: float = 2) -> np.ndarray:
+    """
+    returns indices of the walls a ray in the view can hit first:
+    walls inside the view wedge widened by margin degrees, facing the player if normals are known
+    """
+    keep = in_view(walls, x, y, angle, fov + 2 * margin)
+    if normals is not None:
+        keep &= facing(walls, normals, x, y)
+    return np.flatnonzero(keep)
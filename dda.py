@@ -0,0 +1,128 @@
+from line import Line
+import caster
+import numpy as np
+import profiler
+import util
+
+
+# faces of a solid cell, in the order they are stored in GridCaster.faces
+TOP, BOTTOM, LEFT, RIGHT = range(4)
+
+
+class GridCaster:
+    """
+    casts rays by walking the map grid cell by cell (digital differential analyzer)
+    cost of a ray depends on how far it travels, not on the number of walls
+    """
+    def __init__(self, grid: list[str], w: int, h: int, walls: list[Line]) -> None:
+        if not grid:
+            raise Exception("grid is empty")
+
+        self._cell_w, self._cell_h = util.cell_size(grid, w, h)
+        self._grid_w = len(grid[0])
+        self._grid_h = len(grid)
+        self._solid = np.array([[c != " " for c in row] for row in grid], dtype=bool)
+        self._walls_array = caster.walls_to_array(walls)
+        self.faces = self._build_faces(walls)
+
+    def _build_faces(self, walls: list[Line]) -> np.ndarray:
+        """
+        returns (grid_h, grid_w, 4) array with index of the wall lying on every face
+        of every cell, -1 where there is no wall
+        a wall merged from several faces is found on every one of them
+        """
+        cw = self._cell_w
+        ch = self._cell_h
+        index = {}
+        for i, wall in enumerate(walls):
+            x1, y1, x2, y2 = wall.start.x, wall.start.y, wall.end.x, wall.end.y
+            if y1 == y2:
+                for k in range(round(abs(x2 - x1) / cw)):
+                    x = min(x1, x2) + k * cw
+                    index[(x, y1, x + cw, y1)] = i
+            elif x1 == x2:
+                for k in range(round(abs(y2 - y1) / ch)):
+                    y = min(y1, y2) + k * ch
+                    index[(x1, y, x1, y + ch)] = i
+
+        faces = np.full((self._grid_h, self._grid_w, 4), -1, dtype=np.intp)
+        for i, j in zip(*np.nonzero(self._solid)):
+            x1, y1, x2, y2 = j * cw, i * ch, (j + 1) * cw, (i + 1) * ch
+            faces[i, j, TOP] = index.get((x1, y1, x2, y1), -1)
+            faces[i, j, BOTTOM] = index.get((x1, y2, x2, y2), -1)
+            faces[i, j, LEFT] = index.get((x1, y1, x1, y2), -1)
+            faces[i, j, RIGHT] = index.get((x2, y1, x2, y2), -1)
+        return faces
+
+    def cast_rays(self, starts_x, starts_y, angles) -> caster.Hits:
+        """
+        casts the rays through the grid, angles are in degrees
+        """
+        angles = np.asarray(angles, dtype=np.float64)
+        sx = np.broadcast_to(np.asarray(starts_x, dtype=np.float64), angles.shape)
+        sy = np.broadcast_to(np.asarray(starts_y, dtype=np.float64), angles.shape)
+        n = len(angles)
+        hits = caster.empty_hits(n)
+        hits.angle[:] = angles
+        if n == 0:
+            return hits
+
+        rad = np.radians(angles)
+        dx = np.cos(rad)
+        dy = np.sin(rad)
+        cw = self._cell_w
+        ch = self._cell_h
+
+        cell_x = np.floor(sx / cw).astype(np.intp)
+        cell_y = np.floor(sy / ch).astype(np.intp)
+        step_x = np.where(dx > 0, 1, -1)
+        step_y = np.where(dy > 0, 1, -1)
+
+        # distance along the ray to cross one whole cell, and to reach the next grid line
+        with np.errstate(divide="ignore"):
+            delta_x = np.abs(cw / dx)
+            delta_y = np.abs(ch / dy)
+            side_x = np.where(dx > 0, (cell_x + 1) * cw - sx, sx - cell_x * cw) * delta_x / cw
+            side_y = np.where(dy > 0, (cell_y + 1) * ch - sy, sy - cell_y * ch) * delta_y / ch
+        side_x[dx == 0] = np.inf
+        side_y[dy == 0] = np.inf
+
+        active = np.arange(n)
+        for _ in range(self._grid_w + self._grid_h + 2):
+            if len(active) == 0:
+                break
+            profiler.count("cells_visited", len(active))
+
+            # advance every active ray to its next cell
+            along_x = side_x[active] < side_y[active]
+            ax = active[along_x]
+            ay = active[~along_x]
+            hits.dist[ax] = side_x[ax]
+            hits.dist[ay] = side_y[ay]
+            cell_x[ax] += step_x[ax]
+            cell_y[ay] += step_y[ay]
+            side_x[ax] += delta_x[ax]
+            side_y[ay] += delta_y[ay]
+
+            cx = cell_x[active]
+            cy = cell_y[active]
+            inside = (cx >= 0) & (cx < self._grid_w) & (cy >= 0) & (cy < self._grid_h)
+            solid = np.zeros(len(active), dtype=bool)
+            solid[inside] = self._solid[cy[inside], cx[inside]]
+
+            # the face a ray enters through is opposite to its step direction
+            side = np.where(along_x,
+                            np.where(step_x[active] > 0, LEFT, RIGHT),
+                            np.where(step_y[active] > 0, TOP, BOTTOM))
+            done = active[solid]
+            hits.wall[done] = self.faces[cy[solid], cx[solid], side[solid]]
+
+            active = active[inside & ~solid]
+
+        missed = hits.wall < 0
+        hits.dist[missed] = np.inf
+        hit = ~missed
+        hits.x[hit] = sx[hit] + dx[hit] * hits.dist[hit]
+        hits.y[hit] = sy[hit] + dy[hit] * hits.dist[hit]
+        hits.u[:] = caster.texture_u(hits.x, hits.y, hits.wall, self._walls_array)
+        return hits
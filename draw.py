@@ -2,8 +2,18 @@ import line
 import ray
 import rect
 import player
+import sprites
+import caster
 import pygame as pg
+import constants
+import profiler
+import numpy as np
 from v2 import V2 as v2
+from map_cache import MapData
+
+
+# walls of the minimap drawn once, keyed by the walls list, its length, scale and surface size
+_MINIMAP_CACHE: tuple[tuple, pg.Surface] | None = None
 
 
 def draw_object(w, obj, color = (255, 255, 255), scale: float = 1, offset: v2 = v2(0, 0)) -> None:
@@ -11,6 +21,7 @@ def draw_object(w, obj, color = (255, 255, 255), scale: float = 1, offset: v2 =
     draws an object on the given surface
     the drawings can be modified using scale and offset params
     """
+    profiler.count("objects_drawn")
     match obj.__class__:
         case line.Line:
             pg.draw.line(w, color, list(obj.start * scale + offset), list(obj.end * scale + offset))
@@ -23,5 +34,111 @@ def draw_object(w, obj, color = (255, 255, 255), scale: float = 1, offset: v2 =
             pg.draw.rect(w, color, [*list(obj.top_left * scale + offset), obj.w * scale, obj.h * scale])
         case player.Player:
             pg.draw.circle(w, color, list(obj.get_pos() * scale + offset), obj.get_size() * scale)
+        case sprites.Sprite:
+            pg.draw.circle(w, color, list(obj.get_pos() * scale + offset),
+                           max(1, obj.get_size() / 2 * scale))
         case _:
             raise ValueError("invalid object class")
+
+def clear_minimap_cache() -> None:
+    """
+    forgets the prerendered minimap, needed when the walls list is changed in place
+    """
+    global _MINIMAP_CACHE
+    _MINIMAP_CACHE = None
+
+def _draw_segments(surface: pg.Surface, segments: np.ndarray, color) -> None:
+    """
+    draws (n, 4) x1, y1, x2, y2 segments one pixel wide, all of them in one go
+    every segment is sampled once per pixel of its longer side
+    """
+    w, h = surface.get_size()
+    lo = np.minimum(segments[:, :2], segments[:, 2:])
+    hi = np.maximum(segments[:, :2], segments[:, 2:])
+    segments = segments[(hi[:, 0] >= 0) & (lo[:, 0] < w) & (hi[:, 1] >= 0) & (lo[:, 1] < h)]
+    if len(segments) == 0:
+        return
+
+    steps = np.ceil(np.abs(segments[:, 2:] - segments[:, :2]).max(axis=1)).astype(np.intp) + 1
+    seg = np.repeat(np.arange(len(segments)), steps)
+    t = (np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)) / \
+        np.maximum(steps[seg] - 1, 1)
+    x = np.round(segments[seg, 0] + (segments[seg, 2] - segments[seg, 0]) * t).astype(np.intp)
+    y = np.round(segments[seg, 1] + (segments[seg, 3] - segments[seg, 1]) * t).astype(np.intp)
+    inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+    pixels = pg.surfarray.pixels2d(surface)
+    pixels[x[inside], y[inside]] = surface.map_rgb(color)
+    del pixels
+
+def _draw_dots(surface: pg.Surface, xs: np.ndarray, ys: np.ndarray, radii: np.ndarray,
+               color, rect: tuple[int, int, int, int]) -> None:
+    """
+    draws filled circles centered at the points inside rect (x, y, w, h), clipped to it,
+    all circles of one radius are drawn in a single pixel write
+    """
+    x0, y0, rw, rh = rect
+    inside = (xs >= x0) & (xs < x0 + rw) & (ys >= y0) & (ys < y0 + rh)
+    xs = np.round(xs[inside]).astype(np.intp)
+    ys = np.round(ys[inside]).astype(np.intp)
+    radii = np.round(radii[inside]).astype(np.intp)
+    if len(xs) == 0:
+        return
+
+    pixels = pg.surfarray.pixels2d(surface)
+    value = surface.map_rgb(color)
+    for r in np.unique(radii).tolist():
+        # pixel offsets covered by a circle of this radius
+        dx, dy = np.mgrid[-r:r + 1, -r:r + 1]
+        disc = dx * dx + dy * dy <= r * r
+        dx, dy = dx[disc], dy[disc]
+        same = radii == r
+        px = (xs[same][:, None] + dx[None, :]).ravel()
+        py = (ys[same][:, None] + dy[None, :]).ravel()
+        keep = (px >= x0) & (px < x0 + rw) & (py >= y0) & (py < y0 + rh)
+        pixels[px[keep], py[keep]] = value
+    del pixels
+
+def _minimap_layer(walls: list | MapData, size: tuple[int, int], scale: float) -> pg.Surface:
+    global _MINIMAP_CACHE
+    n = len(walls.walls) if isinstance(walls, MapData) else len(walls)
+    key = (id(walls), n, size, scale)
+    if _MINIMAP_CACHE is not None and _MINIMAP_CACHE[0] == key:
+        return _MINIMAP_CACHE[1]
+
+    layer = pg.Surface((int(size[0] * scale), int(size[1] * scale)))
+    layer.fill(constants.BLACK)
+    segments = walls.walls if isinstance(walls, MapData) else caster.walls_to_array(walls)
+    _draw_segments(layer, np.asarray(segments, dtype=np.float64) * scale, constants.WHITE)
+    _MINIMAP_CACHE = (key, layer)
+    return layer
+
+def draw_minimap(w, walls: list | MapData, p: player.Player, scale: float, offset: v2,
+                 sprite_set: sprites.SpriteSet | None = None) -> None:
+    """
+    draws the walls, the sprites, the player and its view scaled down in the corner of the surface
+    walls are rendered once and reused until different walls are passed
+    """
+    size = w.get_size()
+    layer = _minimap_layer(walls, size, scale)
+    w.blit(layer, (offset[0], offset[1]))
+
+    # the rays are drawn as one polygon from the player to the points they hit
+    hits = p.get_rays_hits()
+    if len(hits.angle):
+        pos = p.get_hits_pose()[0]
+        rad = np.radians(hits.angle)
+        dist = np.minimum(hits.dist, max(size))
+        xs = (pos.x + np.cos(rad) * dist) * scale + offset[0]
+        ys = (pos.y + np.sin(rad) * dist) * scale + offset[1]
+        points = [(pos.x * scale + offset[0], pos.y * scale + offset[1]),
+                  *zip(xs.tolist(), ys.tolist())]
+        pg.draw.polygon(w, constants.GRAY, points)
+
+    if sprite_set is not None:
+        # every sprite at once, a draw_object call per sprite is too slow for thousands
+        alive = sprite_set.alive
+        rect = pg.Rect(int(offset[0]), int(offset[1]), *layer.get_size()).clip(w.get_rect())
+        _draw_dots(w, sprite_set.x[alive] * scale + offset[0], sprite_set.y[alive] * scale + offset[1],
+                   np.maximum(1, sprite_set.size[alive] / 2 * scale), constants.BLUE, rect)
+
+    draw_object(w, p, scale=scale, offset=offset)
@@ -0,0 +1,120 @@
+from typing import NamedTuple
+from map_cache import MapData
+from dda import GridCaster
+from render import Renderer, stretch, to_rgb
+import numpy as np
+import backends
+import culling
+import profiler
+import caster
+
+
+class Camera(NamedTuple):
+    """
+    viewpoint of one frame, angles are in degrees
+    rays are spread evenly from one edge of the fov to the other
+    """
+    x: float
+    y: float
+    angle: float
+    fov: float = 60
+    rays: int = 250
+
+    def angles(self) -> np.ndarray:
+        return np.linspace(self.angle - self.fov / 2, self.angle + self.fov / 2, self.rays)
+
+
+class HeadlessRenderer:
+    """
+    renders many cameras in one map without a display or a player
+    the rays of all cameras are cast in one call to a single backend, so a process pool
+    is shared by every camera and its per-call overhead is paid once per batch,
+    backends that test every wall cast each camera against its own culled walls instead
+    engine is one of the player's engines, auto is calibrated on the first batch
+    """
+    def __init__(self, level: MapData, w: int, h: int, engine: str = "numpy",
+                 grid_caster: GridCaster | None = None, cull: bool = True) -> None:
+        self._level = level
+        self._walls = np.ascontiguousarray(level.walls, dtype=np.float64)
+        self._engine = engine
+        self._grid_caster = grid_caster
+        self._cull = cull
+        self._renderer = Renderer(w, h, level)
+        self._w = w
+        self._h = h
+        self._backend: backends.Backend | None = None
+        if engine != "auto":
+            self._backend = backends.create(engine, self._walls, level.index, grid_caster)
+        self.calibration: list[tuple[str, float]] = []
+
+    def _visible_walls(self, cam: Camera) -> np.ndarray:
+        """
+        returns indices of the walls the camera can see
+        """
+        ids = self._level.pvs.walls_at(cam.x, cam.y) if self._level.pvs is not None else None
+        walls = self._walls if ids is None else self._walls[ids]
+        normals = self._level.normals if ids is None else self._level.normals[ids]
+        subset = culling.visible_walls(walls, normals, cam.x, cam.y, cam.angle, cam.fov)
+        return subset if ids is None else ids[subset]
+
+    def _cast_with(self, backend: backends.Backend, cameras: list[Camera]) -> list[caster.Hits]:
+        angles = [cam.angles() for cam in cameras]
+        if self._cull and backend.culls:
+            # backends testing every wall are cheaper per camera on its own visible walls,
+            # in one batch every ray would test the walls seen by any camera
+            return [backend.cast(cam.x, cam.y, cam_angles, self._visible_walls(cam))
+                    for cam, cam_angles in zip(cameras, angles)]
+
+        counts = [len(a) for a in angles]
+        sx = np.repeat([cam.x for cam in cameras], counts).astype(np.float64)
+        sy = np.repeat([cam.y for cam in cameras], counts).astype(np.float64)
+        hits = backend.cast(sx, sy, np.concatenate(angles))
+        bounds = np.cumsum(counts)[:-1]
+        return [caster.Hits(*parts) for parts in zip(*(np.split(a, bounds) for a in hits))]
+
+    def cast(self, cameras: list[Camera]) -> list[caster.Hits]:
+        """
+        returns the hits of every camera, hits.dist is the depth along each ray
+        """
+        if not cameras:
+            return []
+        profiler.count("rays_cast", sum(cam.rays for cam in cameras))
+
+        if self._backend is None:
+            # every backend is timed casting the batch the way it would cast it here
+            def cast(backend: backends.Backend, turn: float) -> list[caster.Hits]:
+                return self._cast_with(backend, [cam._replace(angle=cam.angle + turn)
+                                                 for cam in cameras])
+
+            angles = np.concatenate([cam.angles() for cam in cameras])
+            sx = np.repeat([cam.x for cam in cameras], [cam.rays for cam in cameras])
+            sy = np.repeat([cam.y for cam in cameras], [cam.rays for cam in cameras])
+            self._backend, self.calibration = backends.calibrate(
+                self._walls, self._level.index, sx, sy, angles, self._grid_caster, cast=cast)
+
+        with profiler.scope("cast"):
+            return self._cast_with(self._backend, cameras)
+
+    def render(self, cameras: list[Camera], hits: list[caster.Hits] | None = None) -> np.ndarray:
+        """
+        returns an (n_cameras, h, w, 3) uint8 array of rgb frames
+        hits from cast can be passed in to not cast the same rays again
+        """
+        if hits is None:
+            hits = self.cast(cameras)
+        frames = np.empty((len(cameras), self._h, self._w), dtype=np.uint32)
+        with profiler.scope("render"):
+            for frame, cam, cam_hits in zip(frames, cameras, hits):
+                stretch(self._renderer.render_columns(cam_hits, cam.angle, (cam.x, cam.y)), frame)
+        return to_rgb(frames)
+
+    def get_backend(self) -> backends.Backend | None:
+        return self._backend
+
+    def close(self) -> None:
+        """
+        shuts down the backend and its workers
+        """
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
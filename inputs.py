@@ -0,0 +1,90 @@
+from typing import Iterator
+from player import Player
+import pygame as pg
+import constants
+import msgpack
+
+
+TRACE_VERSION = 1
+
+# movement keys held during a frame, packed into one int
+FORWARD = 1
+BACKWARDS = 2
+RIGHT = 4
+LEFT = 8
+
+
+def read_actions(keys_pressed: dict) -> int:
+    """
+    returns the movement keys held in keys_pressed as FORWARD | BACKWARDS | RIGHT | LEFT flags
+    """
+    actions = 0
+    if keys_pressed.get(pg.K_UP) or keys_pressed.get(constants.K_W):
+        actions |= FORWARD
+    if keys_pressed.get(pg.K_DOWN) or keys_pressed.get(constants.K_S):
+        actions |= BACKWARDS
+    if keys_pressed.get(pg.K_RIGHT) or keys_pressed.get(constants.K_D):
+        actions |= RIGHT
+    if keys_pressed.get(pg.K_LEFT) or keys_pressed.get(constants.K_A):
+        actions |= LEFT
+    return actions
+
+def apply(p: Player, actions: int, mouse_dx: int, dt: float) -> None:
+    """
+    moves and turns the player for one frame, the game and replays both go through here
+    """
+    if actions & FORWARD:
+        p.move_forward(dt)
+    if actions & BACKWARDS:
+        p.move_backwards(dt)
+
+    if actions & RIGHT:
+        p.move_right(dt)
+    if actions & LEFT:
+        p.move_left(dt)
+
+    p.rotate_right(mouse_dx * constants.MOUSE_SENSITIVITY, dt)
+
+
+class InputRecorder:
+    """
+    writes the input of every frame to a msgpack stream
+    the stream starts with a header map, then every frame is [dt_ms, actions, mouse_dx]
+    with the new number of rays appended on frames where it changed,
+    dt is kept in whole milliseconds as the game clock gives it, so replays are exact
+    """
+    def __init__(self, path: str, header: dict) -> None:
+        self._file = open(path, "wb")
+        self._packer = msgpack.Packer()
+        self._file.write(self._packer.pack({"version": TRACE_VERSION, **header}))
+        self.frames = 0
+
+    def record(self, dt_ms: int, actions: int, mouse_dx: int, rays: int | None = None) -> None:
+        frame = [dt_ms, actions, mouse_dx] if rays is None else [dt_ms, actions, mouse_dx, rays]
+        self._file.write(self._packer.pack(frame))
+        self.frames += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_trace(path: str) -> tuple[dict, Iterator[list]]:
+    """
+    returns the header of a trace written by InputRecorder and an iterator over its frames
+    """
+    f = open(path, "rb")
+    unpacker = msgpack.Unpacker(f)
+    try:
+        header = next(unpacker)
+    except StopIteration:
+        f.close()
+        raise ValueError(f"{path} is not an input trace") from None
+    if not isinstance(header, dict) or header.get("version") != TRACE_VERSION:
+        f.close()
+        raise ValueError(f"{path} is not an input trace of version {TRACE_VERSION}")
+
+    def frames() -> Iterator[list]:
+        with f:
+            yield from unpacker
+
+    return header, frames()
@@ -0,0 +1,57 @@
+import random
+
+
+DEFAULT = [
+    "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb",
+    "b                                                         b",
+    "b        ww  ww w      w      ww w      ww w         ww w b",
+    "b ww www   w         w      w         w         ww w      b",
+    "b                                                         b",
+    "b    bbb   b                                       b      b",
+    "bbbbbbbbb  bb  bbb  bbbbb  bbb  bbb  bbb  bbb  bbbbbb  bbbb",
+    "b                                                         b",
+    "b                                                         b",
+    "b                                                         b",
+    "b        ww  ww w      w      ww w      ww w         ww w b",
+    "b ww www   w         w      w         w         ww w      b",
+    "b                                                         b",
+    "b    bbb   b                                       b      b",
+    "bbbbbbbbb  bb  bbb  bbbbb  bbb  bbb  bbb  bbb  bbbbbb  bbbb",
+    "b                                                         b",
+    "b                                                         b",
+    "b                                                         b",
+    "b                                                         b",
+    "b                                                         b",
+    "b                                                         b",
+    "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb",
+]
+
+
+def generate(grid_w: int, grid_h: int, seed: int = 0, density: float = 0.2) -> list[str]:
+    """
+    returns a random level surrounded by a brick wall
+    the same seed always gives the same level
+    """
+    rng = random.Random(seed)
+    rows = ["b" * grid_w]
+    for _ in range(grid_h - 2):
+        row = "".join(rng.choice("bw") if rng.random() < density else " "
+                      for _ in range(grid_w - 2))
+        rows.append("b" + row + "b")
+    rows.append("b" * grid_w)
+
+    # keep the middle free, players spawn there
+    i, j = grid_h // 2, grid_w // 2
+    rows[i] = rows[i][:j] + " " + rows[i][j + 1:]
+    return rows
+
+def spawn_point(grid: list[str], cell: tuple[int, int]) -> tuple[float, float]:
+    """
+    returns center of the empty cell closest to the middle of the grid
+    """
+    ci, cj = len(grid) / 2, len(grid[0]) / 2
+    empty = [(i, j) for i, row in enumerate(grid) for j, c in enumerate(row) if c == " "]
+    if not empty:
+        raise Exception("grid has no empty cells")
+    i, j = min(empty, key=lambda p: (p[0] + 0.5 - ci) ** 2 + (p[1] + 0.5 - cj) ** 2)
+    return (j + 0.5) * cell[0], (i + 0.5) * cell[1]
@@ -1,29 +1,40 @@
 from v2 import V2 as v2
 import pygame as pg
-import constants
+import numpy as np
+import atlas
 import sys
-import importlib
 
 
 class Line:
     def __init__(self, start: v2, end: v2, color = (255, 255, 255),
-                 texture_name: str | None = None) -> None:
+                 texture_name: str | None = None, texture_tiles: float = 1) -> None:
         self.start = start
         self.end = end
         self._color = color
-        self._texture: list[int] = []
+        self.texture_id = 0
+        # the texture repeats texture_tiles times from start to end
+        self.texture_tiles = texture_tiles
 
-        if texture_name is None or not texture_name:
-            self._texture = [255] * (constants.TEXTURE_RESOLUTION ** 2) * 3
-        else:
+        if texture_name:
             try:
-                brick_wall = importlib.import_module(f"textures.{texture_name}")
-                self._texture = brick_wall.texture
-            except ImportError as e:
+                self.texture_id = atlas.get_atlas().get_id(texture_name)
+            except FileNotFoundError as e:
                 print("No such texture")
                 print(e)
                 sys.exit(1)
 
+    def __getstate__(self) -> dict:
+        # texture ids depend on load order, so pickles keep the texture name
+        state = self.__dict__.copy()
+        state["texture_id"] = atlas.get_atlas().get_name(self.texture_id)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        state["texture_id"] = atlas.get_atlas().get_id(state["texture_id"])
+        state.setdefault("texture_tiles", 1)
+        state.pop("texture_offset", None)
+        self.__dict__.update(state)
+
     def len(self) -> float:
         """
         returns lenght of the line
@@ -31,9 +42,20 @@ class Line:
         return self.start.dist(self.end)
 
     def get_texture(self, x: int, y: int) -> tuple[int, int, int]:
-        i = (y * constants.TEXTURE_RESOLUTION + x) * 3
+        r, g, b = atlas.get_atlas().array[self.texture_id, y, x].tolist()
+        return (r, g, b)
 
-        return (self._texture[i], self._texture[i + 1], self._texture[i + 2])
+    def texture_x(self, u: float) -> float:
+        """
+        returns the x texture coordinate, from 0 to 1, of a point u (0 to 1) along the line
+        """
+        return (u * self.texture_tiles) % 1
+
+    def get_texture_array(self) -> np.ndarray:
+        """
+        returns the texture as a (y, x, rgb) array
+        """
+        return atlas.get_atlas().array[self.texture_id]
     
     def contains_point(self, p: v2) -> bool:
         """
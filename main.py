@@ -1,18 +1,54 @@
+import os
 import pygame as pg
 from v2 import V2 as v2
 from player import Player
-from rect import Rect
+from render import Renderer
+from dda import GridCaster
+from adaptive import ResolutionController
+from world import World
+from sprites import SpriteSet
+from capture import Recorder, make_writer
+from inputs import InputRecorder
+import capture
+import inputs
+import argparse
 import constants
+import profiler
 import draw
-import lib
-import math
+import levels
+import sprites
 import util
 
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--profile", metavar="PATH",
+                    help="profile every frame and write a chrome trace (.json) or json lines (.jsonl) on exit")
+parser.add_argument("--world", metavar="DIR",
+                    help="play a chunked world written by world.py instead of the default level")
+parser.add_argument("--offscreen", metavar="WxH",
+                    help="render into a surface of this size without opening a window")
+parser.add_argument("--frames", type=int, help="quit after this many frames")
+parser.add_argument("--record-input", metavar="PATH",
+                    help="write the input of every frame to a trace that replay.py plays back")
+parser.add_argument("--record", metavar="DIR", help="write every frame to the directory")
+parser.add_argument("--record-format", choices=capture.FORMATS, default="raw",
+                    help="one raw rgb24 video, a png per frame or compressed npz chunks")
+parser.add_argument("--record-policy", choices=(capture.DROP, capture.BLOCK), default=capture.DROP,
+                    help="drop frames or wait for the disk when the writer falls behind")
+args = parser.parse_args()
+profiler.PROFILER.enabled = args.profile is not None
+
+if args.offscreen:
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
 pg.init()
 
-# window = pg.display.set_mode((500, 500)) # for debugging 
-window = pg.display.set_mode((0, 0), pg.FULLSCREEN)
+if args.offscreen:
+    # the display is only there for the event queue
+    pg.display.set_mode((1, 1))
+    window = pg.Surface(tuple(int(n) for n in args.offscreen.split("x")))
+else:
+    # window = pg.display.set_mode((500, 500)) # for debugging
+    window = pg.display.set_mode((0, 0), pg.FULLSCREEN)
 SCREEN_WIDTH, SCREEN_HEIGHT = window.get_size()
 LONGEST_LINE_LEN = v2(SCREEN_WIDTH, SCREEN_HEIGHT).mag()
 
@@ -33,159 +69,166 @@ font = pg.font.SysFont("FiraCode", 30)
 
 keys_pressed = {}
 
-# dont forget to remove "map.pkl" file!
-grid = [
-    "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb",
-    "b                                                         b",
-    "b        ww  ww w      w      ww w      ww w         ww w b",
-    "b ww www   w         w      w         w         ww w      b",
-    "b                                                         b",
-    "b    bbb   b                                       b      b",
-    "bbbbbbbbb  bb  bbb  bbbbb  bbb  bbb  bbb  bbb  bbbbbb  bbbb",
-    "b                                                         b",
-    "b                                                         b",
-    "b                                                         b",
-    "b        ww  ww w      w      ww w      ww w         ww w b",
-    "b ww www   w         w      w         w         ww w      b",
-    "b                                                         b",
-    "b    bbb   b                                       b      b",
-    "bbbbbbbbb  bb  bbb  bbbbb  bbb  bbb  bbb  bbb  bbbbbb  bbbb",
-    "b                                                         b",
-    "b                                                         b",
-    "b                                                         b",
-    "b                                                         b",
-    "b                                                         b",
-    "b                                                         b",
-    "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb",
-]
-
-walls = util.generate_map(grid, SCREEN_WIDTH, SCREEN_HEIGHT)
-
-p = Player(v2(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2),
+RAYS_NUMBER = 250
+
+world = None
+if args.world:
+    # only the chunks around the player are loaded, they change as it moves,
+    # the resident walls are passed on as arrays, without making line objects
+    world = World(args.world)
+    spawn = v2(*world.spawn)
+    world.update(spawn.x, spawn.y)
+    level = world.get_data()
+    walls = level
+    grid_caster = None
+else:
+    grid = levels.DEFAULT
+    spawn = v2(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
+
+    # the visible sets are only used when they were precomputed into the map cache,
+    # python pvs.py --width W --height H does that offline
+    level = util.load_map(grid, SCREEN_WIDTH, SCREEN_HEIGHT)
+    walls = level.lines()
+    grid_caster = GridCaster(grid, SCREEN_WIDTH, SCREEN_HEIGHT, walls)
+
+# pickups scattered over the empty cells of the default level
+sprite_set = SpriteSet()
+if world is None:
+    xs, ys = sprites.scatter(grid, util.cell_size(grid, SCREEN_WIDTH, SCREEN_HEIGHT),
+                             constants.SPRITES)
+    sprite_set.add_many(xs, ys, "orb", size=30)
+
+# the fastest casting backend for this machine and map is picked at startup
+p = Player(spawn,
            walls,
            fov=constants.FOV,
-           rays_number=250,
+           rays_number=RAYS_NUMBER,
            r=30,
            speed=400,
-           rotation_speed=100)
+           rotation_speed=100,
+           engine="auto",
+           grid_caster=grid_caster,
+           index=level.index,
+           normals=level.normals,
+           pvs=level.pvs)
+
+renderer = Renderer(SCREEN_WIDTH, SCREEN_HEIGHT, walls, sprites=sprite_set)
+
+# frames are copied into a few buffers and written on a background thread
+recorder = None
+if args.record:
+    recorder = Recorder(make_writer(args.record_format, args.record, SCREEN_WIDTH, SCREEN_HEIGHT,
+                                    constants.TARGET_FPS),
+                        SCREEN_WIDTH, SCREEN_HEIGHT, policy=args.record_policy)
+
+# everything a replay needs to start the same way, then the input of every frame
+input_recorder = None
+if args.record_input:
+    input_recorder = InputRecorder(args.record_input, {
+        "world": args.world, "screen": [SCREEN_WIDTH, SCREEN_HEIGHT],
+        "spawn": [spawn.x, spawn.y], "angle": p.get_angle(), "fov": constants.FOV,
+        "rays": RAYS_NUMBER, "r": 30, "speed": 400, "rotation_speed": 100,
+        "pipelined": constants.PIPELINED_CASTING})
+
+# drops horizontal resolution instead of frame rate on slow machines
+resolution = ResolutionController(RAYS_NUMBER,
+                                  target_fps=constants.TARGET_FPS,
+                                  min_rays=constants.MIN_RAYS,
+                                  max_rays=constants.MAX_RAYS)
 
 running = True
+frame = 0
 while running:
-    for event in pg.event.get():
-        if event.type == pg.QUIT:
-            running = False
+    profiler.PROFILER.begin_frame()
+    with profiler.scope("events"):
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                running = False
 
-        if event.type == pg.MOUSEBUTTONDOWN:
-            if event.button == 1:
-                keys_pressed[constants.LEFT_MOUSE] = True
+            # F3 toggles the profiler and its overlay
+            if event.type == pg.KEYDOWN and event.key == pg.K_F3:
+                profiler.PROFILER.enabled = not profiler.PROFILER.enabled
 
-        if event.type == pg.MOUSEBUTTONUP:
-            if event.button == 1:
-                keys_pressed[constants.LEFT_MOUSE] = False
+            if event.type == pg.MOUSEBUTTONDOWN:
+                if event.button == 1:
+                    keys_pressed[constants.LEFT_MOUSE] = True
 
-        if event.type == pg.KEYDOWN:
-            keys_pressed[event.key] = True
+            if event.type == pg.MOUSEBUTTONUP:
+                if event.button == 1:
+                    keys_pressed[constants.LEFT_MOUSE] = False
 
-        if event.type == pg.KEYUP:
-            keys_pressed[event.key] = False
+            if event.type == pg.KEYDOWN:
+                keys_pressed[event.key] = True
 
-    dt = clock.tick(60) / 1000
+            if event.type == pg.KEYUP:
+                keys_pressed[event.key] = False
+
+    dt_ms = clock.tick(constants.TARGET_FPS)
+    dt = dt_ms / 1000
+
+    rays_number = None
+    if constants.ADAPTIVE_RESOLUTION:
+        # raw time is the work done in the last frame, without waiting for the clock
+        rays_number = resolution.update(clock.get_rawtime() / 1000)
+        if rays_number is not None:
+            p.set_rays_number(rays_number)
 
     text = font.render(str(int(1 / dt)), True, constants.GREEN)
     text_rect = text.get_rect()
     text_rect.topleft = FPS_OFFSET
 
-    if keys_pressed.get(pg.K_UP) or keys_pressed.get(constants.K_W):
-        p.move_forward(dt)
-    if keys_pressed.get(pg.K_DOWN) or keys_pressed.get(constants.K_S):
-        p.move_backwards(dt)
-
-    if keys_pressed.get(pg.K_RIGHT) or keys_pressed.get(constants.K_D):
-        p.move_right(dt)
-    if keys_pressed.get(pg.K_LEFT) or keys_pressed.get(constants.K_A):
-        p.move_left(dt)
-
+    actions = inputs.read_actions(keys_pressed)
     mouse_rel_x = pg.mouse.get_rel()[0]
-    p.rotate_right(mouse_rel_x * constants.MOUSE_SENSITIVITY, dt)
-
-    p.update(walls)
-
-    # i'm not proud of the naming...
-    points = p.get_rays_distances()
-    rects: list[None | Rect] = []
-    n = len(points)
-    rect_width = int(SCREEN_WIDTH / n) + 1
-
-    for i, point in enumerate(points):
-        if point is None:
-            rects.append(None)
-            continue
-
-        # wall
-        true_distance = p.get_pos().dist(point["pos"])
-        ray_angle_diff = p.get_angle() - point["angle"]
-        distance = true_distance * math.cos(lib.degree_to_rad(ray_angle_diff))
-        distance = max(0.1, distance)  # Avoid division by zero
-        rect_height = SCREEN_HEIGHT * 100 / distance # magic number
-
-        # wall's texture
-        h = constants.TEXTURE_RESOLUTION
-        x = int(h * (point["line"].start.dist(point["pos"]) / point["line"].len()))
-        if  0 <= p.get_angle() <= 180 and point["line"].start.y == point["line"].end.y or\
-            90 <= p.get_angle() <= 270 and point["line"].start.x == point["line"].end.x:
-            x = h - x - 1
-
-        for y in range(h):
-            rect_height_offset = (SCREEN_HEIGHT - rect_height) / 2 + rect_height / h * y 
-            rect = Rect(
-                v2(i * rect_width, rect_height_offset),
-                rect_width,
-                rect_height / h
-            )
-
-            brightness = lib.map_value(distance, 0, SCREEN_HEIGHT, 1, 0)
-            brightness = lib.clamp(brightness, 0, 1)
-            color = point["line"].get_texture(x, y)
-            color = (
-                color[0] * brightness,
-                color[1] * brightness,
-                color[2] * brightness
-            )
-
-            if color != (0, 0, 0):
-                rect.color = color
-                rects.append(rect)
-
-    window.fill(constants.BLACK)
-
-    # draw walls
-    for rect in rects:
-        if rect is not None:
-            pg.draw.rect(window,
-                        rect.color,
-                        [*list(rect.top_left), rect.w, rect.h])
+    inputs.apply(p, actions, mouse_rel_x, dt)
+    if input_recorder is not None:
+        input_recorder.record(dt_ms, actions, mouse_rel_x, rays_number)
+
+    if world is not None and world.update(p.get_pos().x, p.get_pos().y):
+        with profiler.scope("stream"):
+            level = world.get_data()
+            walls = level
+            p.set_walls(level)
+            renderer.set_walls(level)
+
+    with profiler.scope("update"):
+        if constants.PIPELINED_CASTING:
+            p.update_pipelined(walls)
+        else:
+            p.update(walls)
+
+    # draw walls, hits may come from the previous frame when casting is pipelined
+    with profiler.scope("render"):
+        pos, angle = p.get_hits_pose()
+        renderer.draw(window, p.get_rays_hits(), angle, (pos.x, pos.y))
 
     # draw minimap
-    pg.draw.rect(window,
-                 constants.BLACK,
-                 [MINIMAP_OFFSET[0],
-                  MINIMAP_OFFSET[1],
-                  SCREEN_WIDTH * constants.MINIMAP_SCALE,
-                  SCREEN_HEIGHT * constants.MINIMAP_SCALE
-                  ]
-                 )
-    for wall in walls:
-        draw.draw_object(window, wall, scale=constants.MINIMAP_SCALE, offset=MINIMAP_OFFSET)
-
-    draw.draw_object(window, p, scale=constants.MINIMAP_SCALE, offset=MINIMAP_OFFSET)
-
-    for ray in p.get_rays():
-        draw.draw_object(window, ray, scale=constants.MINIMAP_SCALE, offset=MINIMAP_OFFSET)
+    with profiler.scope("minimap"):
+        draw.draw_minimap(window, walls, p, constants.MINIMAP_SCALE, MINIMAP_OFFSET, sprite_set)
 
     # draw fps counter
     window.blit(text, text_rect)
+    profiler.PROFILER.draw_overlay(window, font, (FPS_OFFSET[0], FPS_OFFSET[1] + text_rect.h))
+
+    if recorder is not None:
+        with profiler.scope("capture"):
+            recorder.submit(window)
+
+    if not args.offscreen:
+        with profiler.scope("flip"):
+            pg.display.flip()
+    profiler.PROFILER.end_frame()
 
-    pg.display.flip()
+    frame += 1
+    if args.frames is not None and frame >= args.frames:
+        running = False
 
 pg.quit()
 p.close()
+if world is not None:
+    world.close()
+if recorder is not None:
+    recorder.close()
+if input_recorder is not None:
+    input_recorder.close()
+if args.profile:
+    profiler.PROFILER.export(args.profile)
@@ -0,0 +1,153 @@
+from line import Line
+from v2 import V2 as v2
+from spatial import WallGrid
+from pvs import PVS
+import numpy as np
+import hashlib
+import shutil
+import atlas
+import json
+import os
+
+
+# bump whenever generated maps change, old cache entries are then never hit again
+GENERATOR_VERSION = 3
+
+CACHE_DIR = ".map_cache"
+MAX_ENTRIES = 8
+
+_ARRAYS = ("walls", "textures", "lengths", "normals", "tiles")
+
+
+class MapData:
+    """
+    generated level stored as flat arrays, one row per wall
+    walls are (x1, y1, x2, y2), textures index into texture_names,
+    normals point from the wall into the empty cell it faces,
+    the texture repeats tiles times along a wall,
+    pvs is only there when it was precomputed
+    """
+    def __init__(self, walls: np.ndarray, textures: np.ndarray, texture_names: list[str],
+                 normals: np.ndarray, cell: tuple[int, int], lengths: np.ndarray | None = None,
+                 index: WallGrid | None = None, tiles: np.ndarray | None = None,
+                 pvs: PVS | None = None) -> None:
+        self.walls = walls
+        self.textures = textures
+        self.texture_names = texture_names
+        self.normals = normals
+        self.cell = cell
+        if lengths is None:
+            lengths = np.hypot(walls[:, 2] - walls[:, 0], walls[:, 3] - walls[:, 1])
+        self.lengths = lengths
+        self.tiles = tiles if tiles is not None else np.ones(len(walls))
+        self.index = index if index is not None else WallGrid(walls)
+        self.pvs = pvs
+
+    def texture_ids(self) -> np.ndarray:
+        """
+        returns atlas id of the texture of every wall
+        """
+        ids = np.array([atlas.get_atlas().get_id(name) for name in self.texture_names],
+                       dtype=np.intp)
+        return ids[self.textures] if len(ids) else np.zeros(len(self.walls), dtype=np.intp)
+
+    def lines(self) -> list[Line]:
+        """
+        returns the walls as line objects
+        """
+        names = self.texture_names
+        return [Line(v2(x1, y1), v2(x2, y2), texture_name=names[t], texture_tiles=tiles)
+                for (x1, y1, x2, y2), t, tiles in zip(self.walls.tolist(), self.textures.tolist(),
+                                                      self.tiles.tolist())]
+
+
+def cache_key(grid: list[str], w: int, h: int) -> str:
+    """
+    returns a key that changes whenever the grid, the screen size or the generator changes
+    """
+    data = json.dumps({"grid": grid, "w": w, "h": h, "version": GENERATOR_VERSION})
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class MapCache:
+    """
+    directory of generated maps keyed by cache_key
+    every entry is a directory of .npy files that are memory-mapped on load,
+    only the max_entries most recently used entries are kept
+    """
+    def __init__(self, directory: str = CACHE_DIR, max_entries: int = MAX_ENTRIES) -> None:
+        self._directory = directory
+        self._max_entries = max_entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key)
+
+    def get(self, key: str) -> MapData | None:
+        """
+        returns the cached map or None if there is no valid entry for the key
+        """
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            if meta["version"] != GENERATOR_VERSION:
+                return None
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                      for name in _ARRAYS}
+            index_arrays = {name: np.load(os.path.join(path, f"index_{name}.npy"), mmap_mode="r")
+                            for name in ("cell", "origin", "shape", "starts", "ids")}
+            pvs = None
+            if meta.get("pvs"):
+                pvs = PVS.from_arrays({name: np.load(os.path.join(path, f"pvs_{name}.npy"),
+                                                     mmap_mode="r")
+                                       for name in ("cell", "shape", "starts", "ids")})
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # mark as recently used
+        os.utime(path)
+        return MapData(arrays["walls"], arrays["textures"], meta["texture_names"],
+                       arrays["normals"], tuple(meta["cell"]), arrays["lengths"],
+                       WallGrid.from_arrays(arrays["walls"], index_arrays),
+                       arrays["tiles"], pvs)
+
+    def put(self, key: str, data: MapData) -> None:
+        """
+        stores the map, evicting least recently used entries over the limit
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(getattr(data, name)))
+        for name, arr in data.index.arrays().items():
+            np.save(os.path.join(tmp, f"index_{name}.npy"), arr)
+        if data.pvs is not None:
+            for name, arr in data.pvs.arrays().items():
+                np.save(os.path.join(tmp, f"pvs_{name}.npy"), np.ascontiguousarray(arr))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"version": GENERATOR_VERSION, "texture_names": data.texture_names,
+                       "cell": list(data.cell), "pvs": data.pvs is not None}, f)
+
+        # entries appear atomically, a half written one is never read
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for name in os.listdir(self._directory):
+            path = self._path(name)
+            if name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+            entries.append((os.path.getmtime(path), path))
+        entries.sort(reverse=True)
+        for _, path in entries[self._max_entries:]:
+            shutil.rmtree(path, ignore_errors=True)
@@ -3,79 +3,40 @@ from v2 import V2 as v2
 from math import sin, cos
 from ray import Ray
 from line import Line
+from dda import GridCaster
 import lib
-from concurrent.futures import ProcessPoolExecutor
-import math
-import os
-
-
-_WORKER_WALLS = None
-
-def _worker_init(walls_tuples):
-    """Initializer for worker processes; runs once per worker."""
-    global _WORKER_WALLS
-    _WORKER_WALLS = walls_tuples
-
-def _intersect_ray_segment(x1, y1, x2, y2, x3, y3, x4, y4):
-    # robust parametric intersection (ray from p1->p2 vs segment p3->p4)
-    denom = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
-    if abs(denom) < 1e-9:
-        return None
-    t = ((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4)) / denom
-    u = -((x1 - x2) * (y1 - y3) - (y1 - y2) * (x1 - x3)) / denom
-    if t < 0.0 or t > 1.0 or u < 0.0 or u > 1.0:
-        return None
-    ix = x1 + t * (x2 - x1)
-    iy = y1 + t * (y2 - y1)
-    return (ix, iy)
-
-def _cast_rays_chunk(chunk):
-    """
-    Worker function: chunk = (starts_x_list, starts_y_list, angles_list)
-    returns a list of results matching input ray order:
-      None or (angle, ix, iy, wall_index, dist)
-    Uses module-global _WORKER_WALLS (set by initializer).
-    """
-    global _WORKER_WALLS
-    starts_x, starts_y, angles = chunk
-    out = []
-    for sx, sy, angle in zip(starts_x, starts_y, angles):
-        rad = angle * math.pi / 180.0
-        rx2 = sx + math.cos(rad) * 10000.0
-        ry2 = sy + math.sin(rad) * 10000.0
-
-        best_pt = None
-        best_idx = -1
-        best_dist = float("inf")
-
-        # iterate walls that were preloaded into this worker as tuples:
-        # each wall tuple is (x1, y1, x2, y2)
-        for idx, w in enumerate(_WORKER_WALLS):
-            x3, y3, x4, y4 = w
-            pt = _intersect_ray_segment(sx, sy, rx2, ry2, x3, y3, x4, y4)
-            if pt is None:
-                continue
-            dx = pt[0] - sx
-            dy = pt[1] - sy
-            d = math.hypot(dx, dy)
-            if d < best_dist:
-                best_dist = d
-                best_pt = pt
-                best_idx = idx
-
-        if best_pt is None:
-            out.append(None)
-        else:
-            out.append((angle, best_pt[0], best_pt[1], best_idx, best_dist))
-    return out
+from spatial import WallGrid
+from ray_cache import RayCache
+from pvs import PVS
+from map_cache import MapData
+from concurrent.futures import Future, ThreadPoolExecutor
+import backends
+import collision
+import culling
+import profiler
+import caster
+import numpy as np
+
+
+ENGINES = ("numpy", "process", "thread", "serial", "shapely", "dda", "auto")
 
 
 class Player:
-    def __init__(self, pos: v2, walls: list[Line], fov: float = 90, rays_number: float = 100,
+    def __init__(self, pos: v2, walls: list[Line] | MapData, fov: float = 90, rays_number: float = 100,
                  rotation_speed: int = 200, speed: int = 500, angle: float = 0,
-                 r: float = 20) -> None:
+                 r: float = 20, engine: str = "numpy",
+                 grid_caster: GridCaster | None = None,
+                 index: WallGrid | None = None, cache_rays: bool = True,
+                 normals: np.ndarray | None = None, cull: bool = True,
+                 pvs: PVS | None = None) -> None:
+        if engine not in ENGINES:
+            raise ValueError(f"unknown ray casting engine: {engine}")
+        if engine == "dda" and grid_caster is None:
+            raise ValueError("dda engine needs a grid caster")
+
         self._pos = pos
-        self._walls = walls
+        self._engine = engine
+        self._grid_caster = grid_caster
         self._angle = angle
         self._fov = fov
         self._rays_number = rays_number
@@ -84,30 +45,137 @@ class Player:
         self._rotation_speed = rotation_speed
         self._speed = speed
         self._rays: list[Ray] = []
-        self._calculated_rays_points: list[dict[str, v2 | float | Line] | None] = []
-
+        self._calculated_rays_points: list[dict[str, v2 | float | Line] | None] | None = []
+        self._hits = caster.empty_hits(0)
+        # position and angle the current hits were cast from
+        self._hits_pose = (pos, angle)
+        # background casting, see submit_cast
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: tuple[tuple, Future] | None = None
+        # hits are reused while the player stands still or only looks around
+        self._cache_rays = cache_rays
+        self._ray_cache: RayCache | None = None
+        self._first_ray = 0
+        self._walls_version = 0
+        # walls outside the view or facing away are not sent to backends that test every wall,
+        # normals (from the map) enable the facing test,
+        # the pvs holds the walls visible from each cell, only those are culled and cast against
+        self._cull = cull
+
+        self._build_rays()
+
+        self._use_walls(walls, index, normals, pvs)
+        self.calibration: list[tuple[str, float]] = []
+        self._backend = self._make_backend()
+
+    def _make_backend(self) -> backends.Backend:
+        if self._engine != "auto":
+            return backends.create(self._engine, self._walls_array, self._index, self._grid_caster)
+
+        # times every backend on the real map and the real fan of rays,
+        # backends that cull get the same walls they would get in the game
+        pos, angle, _, _, angles = self._get_pose()
+        angles = np.asarray(angles, dtype=np.float64)
+
+        def cast(backend: backends.Backend, turn: float) -> caster.Hits:
+            subset = self._view_walls(pos, angle + turn) if backend.culls else None
+            return backend.cast(pos.x, pos.y, angles + turn, subset)
+
+        backend, self.calibration = backends.calibrate(self._walls_array, self._index,
+                                                       pos.x, pos.y, angles, self._grid_caster,
+                                                       cast=cast)
+        return backend
+
+    def get_backend(self) -> backends.Backend:
+        return self._backend
+
+    def _build_rays(self) -> None:
+        self._rays = []
         angle = -self._fov / 2 + self._angle
         while angle <= self._fov / 2 + self._angle:
             self._rays.append(Ray(self._pos, angle))
             angle += self._ray_degree
 
-        # ---- multiprocessing pool (kept alive) ----
-        # convert walls to primitive tuples once (pickled only on pool creation)
-        self._walls_tuples = [(w.start.x, w.start.y, w.end.x, w.end.y) for w in self._walls]
+        if self._cache_rays:
+            self._ray_cache = RayCache(self._ray_degree)
+            self._aim_rays()
+
+    def _aim_rays(self) -> None:
+        """
+        snaps the rays to the angles the ray cache is indexed by
+        """
+        assert self._ray_cache is not None
+        self._first_ray = self._ray_cache.first_ray(self._angle - self._fov / 2)
+        for i, ray in enumerate(self._rays):
+            ray.rotate((self._first_ray + i) * self._ray_degree - ray.get_angle())
+
+    def _rotate_rays(self, angle: float) -> None:
+        if self._ray_cache is not None:
+            self._aim_rays()
+            return
+        for ray in self._rays:
+            ray.rotate(angle)
+
+    def set_rays_number(self, rays_number: int) -> None:
+        """
+        changes how many rays the player casts, the backend is kept as is
+        a cast still running in the background reads the ray cache, so it is finished first
+        """
+        self.finish_cast()
+        self._rays_number = rays_number
+        self._ray_degree = self._fov / rays_number
+        self._build_rays()
 
-        # choose number of workers (None uses default). You can tune max_workers.
-        max_workers = os.cpu_count() or 2
-        self._pool = ProcessPoolExecutor(
-            max_workers=max_workers,
-            initializer=_worker_init,
-            initargs=(self._walls_tuples,)
-        )
+    def _use_walls(self, walls: list[Line] | MapData, index: WallGrid | None,
+                   normals: np.ndarray | None, pvs: PVS | None) -> None:
+        """
+        keeps the walls as arrays, a map passes its own arrays, index, normals and pvs
+        and its line objects are only made if get_rays_distances asks for them
+        """
+        if isinstance(walls, MapData):
+            self._level: MapData | None = walls
+            self._walls: list[Line] | None = None
+            self._walls_array = np.ascontiguousarray(walls.walls, dtype=np.float64)
+            index = index if index is not None else walls.index
+            normals = normals if normals is not None else walls.normals
+            pvs = pvs if pvs is not None else walls.pvs
+        else:
+            self._level = None
+            self._walls = walls
+            self._walls_array = caster.walls_to_array(walls)
+        self._normals = normals
+        self._pvs = pvs
+        self._index = index if index is not None else WallGrid(self._walls_array)
+
+    def _lines(self) -> list[Line]:
+        if self._walls is None:
+            assert self._level is not None
+            self._walls = self._level.lines()
+        return self._walls
+
+    def set_walls(self, walls: list[Line] | MapData, index: WallGrid | None = None,
+                  grid_caster: GridCaster | None = None,
+                  normals: np.ndarray | None = None, pvs: PVS | None = None) -> None:
+        """
+        replaces the walls the player sees and collides with
+        the current hits index into the old walls, so they are recast right away
+        """
+        if isinstance(self._backend, backends.DdaBackend) and grid_caster is None:
+            raise ValueError("dda engine needs a grid caster")
+        self.finish_cast()
+        self._use_walls(walls, index, normals, pvs)
+        self._grid_caster = grid_caster
+        self._walls_version += 1
+        self._backend.set_walls(self._walls_array, self._index, grid_caster)
+        self.cast_rays()
 
     def close(self):
-        """Shutdown the persistent process pool (call once at program end)."""
-        if getattr(self, "_pool", None) is not None:
-            self._pool.shutdown(wait=True)
-            self._pool = None
+        """Shutdown the casting backend and its workers (call once at program end)."""
+        self.finish_cast()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._backend.close()
 
 
     def get_rays(self) -> list[Ray]:
@@ -122,40 +190,63 @@ class Player:
     def get_size(self) -> float:
         return self._r
 
-    def _calculate_rays(self) -> list[dict[str, v2 | float | Line] | None]:
-        # Prepare simple arrays of ray data (primitive floats)
-        n = len(self._rays)
-        if n == 0:
-            return []
-
-        starts_x = [r.start.x for r in self._rays]
-        starts_y = [r.start.y for r in self._rays]
-        angles = [r.get_angle() for r in self._rays]
+    def get_hits_pose(self) -> tuple[v2, float]:
+        """
+        returns position and angle the current hits were cast from
+        they lag one frame behind the player when casting is pipelined
+        """
+        return self._hits_pose
 
-        # chunking: tune chunk_size (32 is a reasonable starting point)
-        chunk_size = 32
-        chunks = []
-        for i in range(0, n, chunk_size):
-            j = i + chunk_size
-            chunks.append((starts_x[i:j], starts_y[i:j], angles[i:j]))
+    def _cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        profiler.count("rays_cast", len(angles))
+        return self._backend.cast(starts_x, starts_y, angles, subset)
 
-        assert self._pool is not None
-        # map chunks to worker pool (workers already have walls preloaded)
-        chunks_results = list(self._pool.map(_cast_rays_chunk, chunks))
+    def _visible_walls(self, pos: v2, angle: float) -> np.ndarray | None:
+        """
+        returns the walls to cast against, None when the backend does not cull
+        """
+        if not self._backend.culls:
+            return None
+        return self._view_walls(pos, angle)
 
-        # flatten and convert results back to the original API (v2 + Line object)
-        flat = [item for chunk in chunks_results for item in chunk]
+    def _view_walls(self, pos: v2, angle: float) -> np.ndarray | None:
+        """
+        returns indices of the walls rays of the view can hit, None to test all of them
+        with a pvs the cost does not depend on the size of the level
+        """
+        ids = self._pvs.walls_at(pos.x, pos.y) if self._pvs is not None else None
+        if not self._cull:
+            return ids
+
+        with profiler.scope("cull"):
+            walls = self._walls_array if ids is None else self._walls_array[ids]
+            normals = self._normals
+            if normals is not None and ids is not None:
+                normals = normals[ids]
+            # snapped rays can stick out of the fov by half a step
+            subset = culling.visible_walls(walls, normals, pos.x, pos.y,
+                                           angle, self._fov, margin=1 + self._ray_degree)
+        if ids is not None:
+            subset = ids[subset]
+        profiler.count("walls_culled", len(self._walls_array) - len(subset))
+        return subset
+
+    def _hits_to_points(self, hits: caster.Hits) -> list[dict[str, v2 | float | Line] | None]:
+        """
+        converts the hit arrays back to the original API (v2 + Line object)
+        """
         res = []
-        for item in flat:
-            if item is None:
+        lines = self._lines() if len(hits.wall) else []
+        for angle, ix, iy, wall_idx, dist, u in zip(*(a.tolist() for a in hits)):
+            if wall_idx < 0:
                 res.append(None)
             else:
-                angle, ix, iy, wall_idx, dist = item
                 res.append({
                     "angle": angle,
                     "pos": v2(ix, iy),
-                    "line": self._walls[wall_idx],
-                    "dist": dist
+                    "line": lines[wall_idx],
+                    "dist": dist,
+                    "u": u
                 })
         return res
 
@@ -164,16 +255,14 @@ class Player:
         rotates the player clockwise
         """
         self._angle += self._rotation_speed * amt * dt
-        for i, _ in enumerate(self._rays):
-            self._rays[i].rotate(self._rotation_speed * amt * dt)
+        self._rotate_rays(self._rotation_speed * amt * dt)
 
     def rotate_left(self, amt: float, dt: float) -> None:
         """
         rotates the player counter clockwise
         """
         self._angle -= self._rotation_speed * amt * dt
-        for i, _ in enumerate(self._rays):
-            self._rays[i].rotate(-self._rotation_speed * amt * dt)
+        self._rotate_rays(-self._rotation_speed * amt * dt)
 
     def _update_rays_pos(self) -> None:
         for i, _ in enumerate(self._rays):
@@ -215,74 +304,118 @@ class Player:
         self._pos -= offset * dt
         self._update_rays_pos()
 
-    def _intersects_with_line(self, l: Line) -> None | tuple[v2, v2]:
+    def get_rays_distances(self) -> list[dict[str, v2 | float | Line] | None]:
         """
-        returns None if the player doesnt intersects with a line
-        otherwise returns two points where the player and the line intersect
-        two returned points will be the same if the line is tangent to the player
+        returns list of points, where rays hit closest wall
+        if a ray didnt hit any wall, instead of point will be None 
         """
-        # line
-        x1 = l.start.x - self._pos.x
-        y1 = l.start.y - self._pos.y
-        x2 = l.end.x - self._pos.x
-        y2 = l.end.y - self._pos.y
-        a = y1 - y2
-        b = x2 - x1
-        c = y1 * (x2 - x1) - x1 * (y2 - y1)
+        # built lazily, the renderer only needs the arrays
+        if self._calculated_rays_points is None:
+            self._calculated_rays_points = self._hits_to_points(self._hits)
+        return self._calculated_rays_points
 
-        # circle
-        r = self._r
+    def get_rays_hits(self) -> caster.Hits:
+        """
+        returns the same hits as get_rays_distances, but as numpy arrays
+        """
+        return self._hits
 
-        d = (r ** 2) * (a ** 2 + b ** 2) - c ** 2
+    def _get_pose(self) -> tuple:
+        """
+        returns a snapshot of everything a cast depends on
+        """
+        angles = [r.get_angle() for r in self._rays]
+        return (self._pos, self._angle, self._walls_version, self._first_ray, angles)
+
+    def _cast_pose(self, pose: tuple) -> caster.Hits:
+        pos, angle, version, first, angles = pose
+        if self._ray_cache is None:
+            return self._cast(pos.x, pos.y, angles, self._visible_walls(pos, angle))
+
+        # culled only when something has to be cast
+        hits = self._ray_cache.cast(pos.x, pos.y, version, first, len(angles),
+                                    lambda missing: self._cast(pos.x, pos.y, missing,
+                                                               self._visible_walls(pos, angle)))
+        profiler.count("rays_reused", self._ray_cache.last_reused)
+        return hits
+
+    def _set_hits(self, hits: caster.Hits, pose: tuple) -> None:
+        self._hits_pose = (pose[0], pose[1])
+        if hits is not self._hits:
+            self._hits = hits
+            self._calculated_rays_points = None
+
+    def cast_rays(self) -> None:
+        """
+        casts all rays from the current position
+        """
+        self.finish_cast()
+        pose = self._get_pose()
+        with profiler.scope("cast"):
+            hits = self._cast_pose(pose)
+        self._set_hits(hits, pose)
 
-        if d < 0:
-            return 
+    def submit_cast(self) -> Future:
+        """
+        starts casting all rays from the current position in the background
+        and returns a future of the hits, asyncio.wrap_future makes it awaitable
+        the hits replace the current ones with finish_cast
+        """
+        self.finish_cast()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cast")
+        pose = self._get_pose()
 
-        d = d ** 0.5
-        denom = a ** 2 + b ** 2
-        
-        x1 = (a * c + b * d) / denom
-        x2 = (a * c - b * d) / denom
-        y1 = (b * c - a * d) / denom
-        y2 = (b * c + a * d) / denom
+        def cast() -> caster.Hits:
+            with profiler.scope("cast"):
+                return self._cast_pose(pose)
 
-        p1 = v2(x1, y1) + self._pos
-        p2 = v2(x2, y2) + self._pos
+        future = self._executor.submit(cast)
+        self._pending = (pose, future)
+        return future
 
-        if not l.contains_point(p1) and not l.contains_point(p2):
+    def finish_cast(self) -> None:
+        """
+        waits for the cast started by submit_cast, if any, and makes its hits current
+        """
+        if self._pending is None:
             return
-        
-        if not l.contains_point(p1) or not l.contains_point(p2):
-            closest_line_end = l.start
-            far_line_end = l.end
-            if self._pos.dist(closest_line_end) > self._pos.dist(l.end):
-                closest_line_end, far_line_end = far_line_end, closest_line_end
-
-            if (self._pos - closest_line_end).dot(far_line_end - closest_line_end) >= 0:
-                return (p1, p2)
-            return (closest_line_end, closest_line_end)
+        pose, future = self._pending
+        self._pending = None
+        with profiler.scope("cast wait"):
+            hits = future.result()
+        self._set_hits(hits, pose)
 
-        return (p1, p2)
-
-    def get_rays_distances(self) -> list[dict[str, v2 | float | Line] | None]:
+    def collide(self, walls: list[Line] | MapData) -> None:
         """
-        returns list of points, where rays hit closest wall
-        if a ray didnt hit any wall, instead of point will be None 
+        pushes the player out of the walls it overlaps
         """
-        return self._calculated_rays_points
+        with profiler.scope("collide"):
+            # walls far from the player cant collide with it
+            if walls is self._walls or walls is self._level:
+                x, y = collision.resolve(self._pos.x, self._pos.y, self._r,
+                                         self._walls_array, self._index)
+            else:
+                array = walls.walls if isinstance(walls, MapData) else caster.walls_to_array(walls)
+                x, y = collision.push_out(self._pos.x, self._pos.y, self._r, array)
 
-    def update(self, walls: list[Line]) -> None:
+        if (x, y) != (self._pos.x, self._pos.y):
+            self._pos = v2(x, y)
+            self._update_rays_pos()
+
+    def update(self, walls: list[Line] | MapData) -> None:
         """
         update the player
         """
-        self._calculated_rays_points = self._calculate_rays()
-        
-        for wall in walls:
-            pts = self._intersects_with_line(wall)
-            if pts is None:
-                continue
-            center_point = (pts[0] + pts[1]) / 2
-            amt = self._r - self._pos.dist(center_point)
-            direction = (self._pos - center_point).norm()
-            self._pos += direction * amt
+        self.cast_rays()
+        self.collide(walls)
 
+    def update_pipelined(self, walls: list[Line] | MapData) -> None:
+        """
+        update the player, but cast in the background while the frame is drawn
+        collision is resolved first so the cast already sees the final position,
+        the hits of this frame come from the previous one (one frame of latency)
+        """
+        self.collide(walls)
+        self.finish_cast()
+        self.submit_cast()
@@ -0,0 +1,166 @@
+from collections import deque
+from contextlib import nullcontext
+import threading
+import json
+import time
+import os
+
+
+_NULL_SCOPE = nullcontext()
+
+
+class _Scope:
+    def __init__(self, profiler: "Profiler", name: str) -> None:
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        self._profiler.add_event(self._name, self._start, time.perf_counter())
+
+
+class Profiler:
+    """
+    collects named timing scopes and counters per frame
+    keeps the last `history` frames, frames slower than spike_ms are kept separately
+    does (almost) nothing while disabled
+    """
+    def __init__(self, enabled: bool = False, history: int = 600,
+                 spike_ms: float | None = None) -> None:
+        self.enabled = enabled
+        self.spike_ms = spike_ms
+        self.frames: deque[dict] = deque(maxlen=history)
+        self.spikes: deque[dict] = deque(maxlen=history)
+        self._frame: dict | None = None
+        self._frame_number = 0
+        self._pid = os.getpid()
+
+    def begin_frame(self) -> None:
+        if not self.enabled:
+            return
+        self._frame = {"frame": self._frame_number, "start": time.perf_counter(),
+                       "duration": 0.0, "events": [], "counters": {},
+                       "tid": threading.get_ident()}
+        self._frame_number += 1
+
+    def end_frame(self) -> None:
+        if self._frame is None:
+            return
+        frame = self._frame
+        frame["duration"] = time.perf_counter() - frame["start"]
+        self.frames.append(frame)
+        if self.spike_ms is not None and frame["duration"] * 1000 > self.spike_ms:
+            self.spikes.append(frame)
+        self._frame = None
+
+    def scope(self, name: str):
+        """
+        returns a context manager that times its body under the given name
+        """
+        if not self.enabled or self._frame is None:
+            return _NULL_SCOPE
+        return _Scope(self, name)
+
+    def add_event(self, name: str, start: float, end: float,
+                  pid: int | None = None, tid: int | None = None) -> None:
+        """
+        records a span, pid and tid tell which process and thread did the work
+        """
+        if self._frame is None:
+            return
+        self._frame["events"].append((name, start, end,
+                                      pid if pid is not None else self._pid,
+                                      tid if tid is not None else threading.get_ident()))
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self._frame is None:
+            return
+        counters = self._frame["counters"]
+        counters[name] = counters.get(name, 0) + n
+
+    def summary(self, frame: dict) -> dict:
+        """
+        returns total milliseconds per scope name of a frame and its counters
+        """
+        scopes: dict[str, float] = {}
+        workers: dict[str, float] = {}
+        for name, start, end, pid, _ in frame["events"]:
+            scopes[name] = scopes.get(name, 0.0) + (end - start) * 1000
+            if pid != self._pid:
+                key = f"{name}@{pid}"
+                workers[key] = workers.get(key, 0.0) + (end - start) * 1000
+        return {"frame": frame["frame"], "duration": frame["duration"] * 1000,
+                "scopes": scopes, "workers": workers, "counters": dict(frame["counters"])}
+
+    def _recorded_frames(self) -> list[dict]:
+        frames = {frame["frame"]: frame for frame in (*self.spikes, *self.frames)}
+        return [frames[k] for k in sorted(frames)]
+
+    def export_trace(self, path: str) -> None:
+        """
+        writes recorded frames as chrome trace events (chrome://tracing, perfetto)
+        """
+        events = []
+        for frame in self._recorded_frames():
+            events.append({"name": f"frame {frame['frame']}", "ph": "X", "pid": self._pid,
+                           "tid": frame["tid"], "ts": frame["start"] * 1e6,
+                           "dur": frame["duration"] * 1e6})
+            for name, start, end, pid, tid in frame["events"]:
+                events.append({"name": name, "ph": "X", "pid": pid, "tid": tid,
+                               "ts": start * 1e6, "dur": (end - start) * 1e6})
+            if frame["counters"]:
+                events.append({"name": "counters", "ph": "C", "pid": self._pid,
+                               "ts": frame["start"] * 1e6, "args": frame["counters"]})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def export_jsonl(self, path: str) -> None:
+        """
+        writes one json summary per recorded frame
+        """
+        with open(path, "w") as f:
+            for frame in self._recorded_frames():
+                f.write(json.dumps(self.summary(frame)) + "\n")
+
+    def export(self, path: str) -> None:
+        """
+        writes json lines for .jsonl paths and a chrome trace otherwise
+        """
+        if path.endswith(".jsonl"):
+            self.export_jsonl(path)
+        else:
+            self.export_trace(path)
+
+    def draw_overlay(self, surface, font, pos: tuple[int, int], color=(0, 255, 0)) -> None:
+        """
+        draws stage timings and counters of the last finished frame
+        """
+        if not self.enabled or not self.frames:
+            return
+        summary = self.summary(self.frames[-1])
+        lines = [f"frame {summary['duration']:.2f} ms"]
+        lines += [f"{name} {ms:.2f} ms" for name, ms in summary["scopes"].items()]
+        lines += [f"{name} {n}" for name, n in summary["counters"].items()]
+        x, y = pos
+        for line in lines:
+            text = font.render(line, True, color)
+            surface.blit(text, (x, y))
+            y += text.get_height()
+
+
+PROFILER = Profiler()
+
+def scope(name: str):
+    """
+    times a block on the shared profiler
+    """
+    return PROFILER.scope(name)
+
+def count(name: str, n: int = 1) -> None:
+    """
+    increments a counter of the current frame on the shared profiler
+    """
+    PROFILER.count(name, n)
@@ -0,0 +1,207 @@
+from typing import TYPE_CHECKING
+import numpy as np
+import profiler
+import time
+
+if TYPE_CHECKING:
+    from dda import GridCaster
+
+
+class PVS:
+    """
+    potentially visible set: for every cell of the grid the walls that can be seen from it
+    stored in csr layout, walls seen from cell k are ids[starts[k]:starts[k + 1]]
+    """
+    def __init__(self, cell: tuple[float, float], shape: tuple[int, int],
+                 starts: np.ndarray, ids: np.ndarray) -> None:
+        self.cell = cell
+        self.shape = shape
+        self.starts = starts
+        self.ids = ids
+
+    def walls_at(self, x: float, y: float) -> np.ndarray | None:
+        """
+        returns ids of the walls visible from the cell containing the point,
+        None (every wall) outside of the grid and in cells that see nothing,
+        the player can end up inside a solid cell and still see out of it
+        """
+        i = int(y // self.cell[1])
+        j = int(x // self.cell[0])
+        rows, cols = self.shape
+        if not (0 <= i < rows and 0 <= j < cols):
+            return None
+        k = i * cols + j
+        if self.starts[k] == self.starts[k + 1]:
+            return None
+        return self.ids[self.starts[k]:self.starts[k + 1]]
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"cell": np.array(self.cell, dtype=np.float64),
+                "shape": np.array(self.shape, dtype=np.intp),
+                "starts": self.starts, "ids": self.ids}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "PVS":
+        cell = arrays["cell"].tolist()
+        rows, cols = arrays["shape"].tolist()
+        return cls((cell[0], cell[1]), (rows, cols), arrays["starts"], arrays["ids"])
+
+
+def _ring_points(samples: int) -> np.ndarray:
+    # the border of a samples x samples lattice inside the cell, kept off the grid lines
+    t = np.linspace(0.02, 0.98, max(samples, 2))
+    points = np.stack(np.meshgrid(t, t), axis=-1).reshape(-1, 2)
+    return points[((points == t[0]) | (points == t[-1])).any(axis=1)]
+
+def _dilate(starts: np.ndarray, ids: np.ndarray, shape: tuple[int, int],
+            empty: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    adds the walls seen from the 8 neighbours to the set of every empty cell
+    """
+    rows, cols = shape
+    cells = []
+    merged = []
+    for k in empty.tolist():
+        i, j = divmod(k, cols)
+        parts = [ids[starts[a * cols + b]:starts[a * cols + b + 1]]
+                 for a in range(max(i - 1, 0), min(i + 2, rows))
+                 for b in range(max(j - 1, 0), min(j + 2, cols))]
+        walls = np.unique(np.concatenate(parts))
+        merged.append(walls)
+        cells.append(np.full(len(walls), k, dtype=np.intp))
+    if not merged:
+        return starts, ids
+    counts = np.bincount(np.concatenate(cells), minlength=rows * cols)
+    return np.concatenate(([0], np.cumsum(counts))).astype(np.intp), np.concatenate(merged)
+
+def _cast_walls(grid_caster: "GridCaster", sx: np.ndarray, sy: np.ndarray, angles: np.ndarray,
+                budget: int) -> np.ndarray:
+    """
+    returns the wall every ray hits, -1 where none, casting at most budget rays at a time
+    """
+    walls = np.empty(len(angles), dtype=np.intp)
+    for i in range(0, len(angles), budget):
+        j = i + budget
+        walls[i:j] = grid_caster.cast_rays(sx[i:j], sy[i:j], angles[i:j]).wall
+    return walls
+
+def build_pvs(grid: list[str], grid_caster: "GridCaster", cell: tuple[float, float],
+              walls: np.ndarray, samples: int = 4, spread: float = 0.01, sweep: float = 2.0,
+              budget: int = 1 << 18, dilate: bool = True) -> PVS:
+    """
+    records every wall seen from points along the border of every empty cell,
+    solid cells get an empty set
+    what a point sees only changes at the ends of the walls it sees, so after a sweep of rays
+    every sweep degrees, rays are aimed spread degrees to both sides of the ends of the walls
+    found until no new walls turn up, walls hidden from the cell are never aimed at
+    a ray from inside the cell leaves it through the border and sees what the border sees,
+    the sets of the 8 neighbours (dilate) cover the border between the sampled points
+    at most budget rays are cast at once, which bounds the memory of the build
+    """
+    walls = np.asarray(walls, dtype=np.float64).reshape(-1, 4)
+    n_walls = len(walls)
+    rows, cols = len(grid), len(grid[0])
+    cw, ch = cell
+    empty = np.array([i * cols + j for i in range(rows) for j in range(cols)
+                      if grid[i][j] == " "], dtype=np.intp)
+    points = _ring_points(samples)
+    ends, wall_ends = np.unique(walls.reshape(-1, 2), axis=0, return_inverse=True)
+    wall_ends = wall_ends.reshape(-1, 2)
+    n_ends = len(ends)
+    fan = np.arange(0, 360, sweep)
+    turns = np.array([-spread, spread])
+    batch = max(1, budget // (len(points) * len(fan)))
+    pairs_at_once = max(1, budget // (len(points) * len(turns)))
+
+    cells = []
+    ids = []
+    with profiler.scope("pvs"):
+        for b in range(0, len(empty), batch):
+            ks = empty[b:b + batch]
+            i, j = np.divmod(ks, cols)
+            sx = (j[:, None] + points[None, :, 0]) * cw
+            sy = (i[:, None] + points[None, :, 1]) * ch
+
+            # (cells, points, fan) rays, keys are local cell * n_walls + wall
+            shape = (len(ks), len(points), len(fan))
+            hits = _cast_walls(grid_caster, np.broadcast_to(sx[:, :, None], shape).ravel(),
+                               np.broadcast_to(sy[:, :, None], shape).ravel(),
+                               np.broadcast_to(fan, shape).ravel(), budget)
+            owner = np.repeat(np.arange(len(ks)), len(points) * len(fan))
+            hit = hits >= 0
+            seen = np.unique(owner[hit] * n_walls + hits[hit])
+            new = seen
+            aimed = np.zeros(0, dtype=np.intp)
+
+            while len(new):
+                # ends of the walls found last round not aimed at yet,
+                # keys are local cell * n_ends + end
+                c, w = np.divmod(new, n_walls)
+                targets = np.unique(np.concatenate((c * n_ends + wall_ends[w, 0],
+                                                    c * n_ends + wall_ends[w, 1])))
+                targets = np.setdiff1d(targets, aimed, assume_unique=True)
+                if len(targets) == 0:
+                    break
+                aimed = np.union1d(aimed, targets)
+
+                found = []
+                for t in range(0, len(targets), pairs_at_once):
+                    c, e = np.divmod(targets[t:t + pairs_at_once], n_ends)
+                    # (targets, points, turns) rays
+                    angles = np.degrees(np.arctan2(ends[e, 1][:, None] - sy[c],
+                                                   ends[e, 0][:, None] - sx[c]))
+                    angles = angles[..., None] + turns
+                    shape = angles.shape
+                    hits = _cast_walls(grid_caster,
+                                       np.broadcast_to(sx[c][:, :, None], shape).ravel(),
+                                       np.broadcast_to(sy[c][:, :, None], shape).ravel(),
+                                       angles.ravel(), budget)
+                    owner = np.repeat(c, len(points) * len(turns))
+                    hit = hits >= 0
+                    found.append(owner[hit] * n_walls + hits[hit])
+                new = np.setdiff1d(np.concatenate(found), seen)
+                seen = np.union1d(seen, new)
+
+            cells.append(ks[seen // n_walls])
+            ids.append(seen % n_walls)
+
+    cells = np.concatenate(cells) if cells else np.zeros(0, dtype=np.intp)
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.intp)
+    counts = np.bincount(cells, minlength=rows * cols)
+    starts = np.concatenate(([0], np.cumsum(counts))).astype(np.intp)
+    ids = ids.astype(np.intp)
+    if dilate:
+        starts, ids = _dilate(starts, ids, (rows, cols), empty)
+    return PVS((float(cw), float(ch)), (rows, cols), starts, ids)
+
+
+def main() -> None:
+    # util imports the map cache, which imports this module
+    import argparse
+    import levels
+    import util
+
+    parser = argparse.ArgumentParser(description="precomputes the potentially visible sets "
+                                                 "of a level into the map cache")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--level", default="default",
+                        help="default, or WxH[:seed] for a generated level")
+    args = parser.parse_args()
+
+    if args.level == "default":
+        grid = levels.DEFAULT
+    else:
+        size, _, seed = args.level.partition(":")
+        grid_w, grid_h = (int(n) for n in size.split("x"))
+        grid = levels.generate(grid_w, grid_h, seed=int(seed or 0))
+
+    start = time.perf_counter()
+    level = util.load_map(grid, args.width, args.height, pvs=True)
+    assert level.pvs is not None
+    print(f"{len(level.pvs.ids)} visible walls in {level.pvs.shape[0] * level.pvs.shape[1]} cells, "
+          f"{time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,14 +15,30 @@ class Ray:
                                sin(lib.degree_to_rad(self._angle)))
 
     def __init__(self, start: v2, angle: float = 0, color = (255, 255, 255)) -> None:
-        self.start = start
+        self._start = start
         self._angle = angle
         self._color = color
         self.end = self._get_end()
-        ray_end = self.start + lib.v2_from_angle(self.get_angle()) * 10000
-        self._ray_line = LineString([(self.start.x, self.start.y), (ray_end.x, ray_end.y)])
+        # built on demand, most rays never need their geometry
+        self._ray_line: LineString | None = None
+
+    @property
+    def start(self) -> v2:
+        return self._start
+
+    @start.setter
+    def start(self, start: v2) -> None:
+        self._start = start
+        self.end = self._get_end()
+        self._ray_line = None
 
     def get_ray_line(self) -> LineString:
+        """
+        returns the ray as a long line, kept in sync with rotation and movement
+        """
+        if self._ray_line is None:
+            ray_end = self.start + lib.v2_from_angle(self.get_angle()) * 10000
+            self._ray_line = LineString([(self.start.x, self.start.y), (ray_end.x, ray_end.y)])
         return self._ray_line
 
     def get_angle(self) -> float:
@@ -31,6 +47,7 @@ class Ray:
     def rotate(self, angle) -> None:
         self._angle += angle
         self.end = self._get_end()
+        self._ray_line = None
 
     def intersects_with_line(self, l: Line) -> v2 | None:
         """
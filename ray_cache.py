@@ -0,0 +1,74 @@
+from typing import Callable
+import numpy as np
+import caster
+import math
+
+
+class RayCache:
+    """
+    remembers hits of the rays cast from one position, indexed by angle
+    ray k points at angle k * step, so after a pure rotation the rays still inside the fov
+    are found by their index and only the newly exposed ones have to be cast
+    everything is dropped when the position, the walls or the step change
+    """
+    def __init__(self, step: float) -> None:
+        self.step = step
+        # one slot per lattice angle of the whole circle, slot of ray k is k % size
+        self._size = math.ceil(360 / step) + 1
+        self._keys = np.full(self._size, np.iinfo(np.int64).min, dtype=np.int64)
+        self._x = np.zeros(self._size)
+        self._y = np.zeros(self._size)
+        self._wall = np.full(self._size, -1, dtype=np.intp)
+        self._dist = np.full(self._size, np.inf)
+        self._u = np.zeros(self._size)
+        self._origin: tuple[float, float, int] | None = None
+        self._last: tuple[int, int] | None = None
+        self._hits = caster.empty_hits(0)
+        self.last_reused = 0
+
+    def first_ray(self, angle: float) -> int:
+        """
+        returns index of the lattice ray closest to the given angle
+        """
+        return round(angle / self.step)
+
+    def angles(self, first: int, n: int) -> np.ndarray:
+        return np.arange(first, first + n) * self.step
+
+    def clear(self) -> None:
+        self._keys[:] = np.iinfo(np.int64).min
+        self._origin = None
+        self._last = None
+
+    def cast(self, x: float, y: float, version: int, first: int, n: int,
+             cast: Callable[[np.ndarray], caster.Hits]) -> caster.Hits:
+        """
+        returns hits of rays first..first + n from (x, y)
+        cast gets the angles of the rays missing in the cache and returns their hits
+        the returned object is the previous one if nothing changed since the last call
+        """
+        if (x, y, version) != self._origin:
+            self.clear()
+            self._origin = (x, y, version)
+        elif self._last == (first, n):
+            self.last_reused = n
+            return self._hits
+
+        ks = np.arange(first, first + n, dtype=np.int64)
+        slots = ks % self._size
+        missing = self._keys[slots] != ks
+        self.last_reused = n - int(np.count_nonzero(missing))
+        if missing.any():
+            new = cast(ks[missing] * self.step)
+            idx = slots[missing]
+            self._keys[idx] = ks[missing]
+            self._x[idx] = new.x
+            self._y[idx] = new.y
+            self._wall[idx] = new.wall
+            self._dist[idx] = new.dist
+            self._u[idx] = new.u
+
+        self._last = (first, n)
+        self._hits = caster.Hits(ks * self.step, self._x[slots], self._y[slots],
+                                 self._wall[slots], self._dist[slots], self._u[slots])
+        return self._hits
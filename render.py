@@ -0,0 +1,220 @@
+from typing import TYPE_CHECKING
+from line import Line
+from caster import Hits
+from map_cache import MapData
+import pygame as pg
+import numpy as np
+import constants
+import profiler
+import atlas
+
+if TYPE_CHECKING:
+    from sprites import SpriteSet
+
+
+# world height of a wall, projected height of a wall is SCREEN_HEIGHT * WALL_HEIGHT / distance
+WALL_HEIGHT = 100
+
+
+def build_textures(walls: list[Line]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    returns the shared (n_textures, res, res, 3) texture atlas and the texture id of every wall
+    """
+    ids = np.fromiter((wall.texture_id for wall in walls), dtype=np.intp, count=len(walls))
+    return atlas.get_atlas().array, ids
+
+
+def get_texture(name: str) -> np.ndarray:
+    """
+    returns the (res, res, 3) texture from the shared atlas, loading it on first use
+    """
+    textures = atlas.get_atlas()
+    texture_id = textures.get_id(name)
+    return textures.array[texture_id]
+
+
+def shade_table(texture: np.ndarray) -> np.ndarray:
+    """
+    returns a (256, res * res) array of the texture's packed pixels at every brightness level
+    shading a texel is then a single lookup, level 255 is full brightness
+    """
+    levels = np.arange(256, dtype=np.float32) / 255
+    table = np.zeros((256, *texture.shape[:2], 4), dtype=np.uint8)
+    table[..., :3] = texture[None] * levels[:, None, None, None]
+    return table.view(np.uint32).reshape(256, -1)
+
+
+def to_rgb(pixels: np.ndarray) -> np.ndarray:
+    """
+    returns a (..., 3) rgb view of packed rgbx pixels
+    """
+    return pixels.view(np.uint8).reshape(*pixels.shape, 4)[..., :3]
+
+
+def stretch(columns: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    fills the (h, w) frame with the columns, every column becomes a band of equal width
+    """
+    n = len(columns)
+    if n == 0:
+        out[:] = 0
+        return out
+    rect_width = int(out.shape[1] / n) + 1
+    out[:] = np.repeat(columns.T, rect_width, axis=1)[:, :out.shape[1]]
+    return out
+
+
+class Renderer:
+    """
+    draws textured and shaded wall columns into a numpy framebuffer
+    the whole frame is pushed to the screen with a single blit
+    pixels are packed as uint32 with rgbx byte order
+    floor and ceiling textures repeat every floor_tile world units, None leaves them black
+    sprites are drawn over the walls they are in front of
+    """
+    def __init__(self, w: int, h: int, walls: list[Line] | MapData,
+                 floor: str | None = constants.FLOOR_TEXTURE,
+                 ceiling: str | None = constants.CEILING_TEXTURE,
+                 floor_tile: float = WALL_HEIGHT, sprites: "SpriteSet | None" = None) -> None:
+        self._w = w
+        self._h = h
+        self.sprites = sprites
+        self._floor = shade_table(get_texture(floor)) if floor else None
+        self._ceiling = shade_table(get_texture(ceiling)) if ceiling else None
+        self._floor_tile = floor_tile
+        self.set_walls(walls)
+
+        self._rows = np.arange(h, dtype=np.float64)
+        self.frame = np.zeros((h, w), dtype=np.uint32)
+
+        # rows below the horizon and the distance of the floor seen at each of them,
+        # the ceiling at row h - r is at the same distance as the floor at row r
+        self._flat_rows = np.arange(h // 2 + 1, h + 1)
+        self._flat_dist = h * WALL_HEIGHT / (2 * (self._flat_rows - h / 2))
+        self._flat_levels = (np.clip(1 - self._flat_dist / h, 0, 1) * 255).astype(np.intp)
+
+    def set_walls(self, walls: list[Line] | MapData) -> None:
+        """
+        replaces the walls the hits index into
+        a map is read straight from its arrays, without making line objects
+        """
+        if isinstance(walls, MapData):
+            # ids first, loading a texture makes a new atlas array
+            self._wall_textures = walls.texture_ids()
+            self._textures = atlas.get_atlas().array
+            walls_array = np.asarray(walls.walls, dtype=np.float64)
+            tiles = np.asarray(walls.tiles, dtype=np.float64)
+        else:
+            self._textures, self._wall_textures = build_textures(walls)
+            walls_array = np.array([(l.start.x, l.start.y, l.end.x, l.end.y) for l in walls],
+                                   dtype=np.float64).reshape(-1, 4)
+            tiles = np.array([l.texture_tiles for l in walls], dtype=np.float64)
+
+        self._horizontal = walls_array[:, 1] == walls_array[:, 3]
+        self._vertical = walls_array[:, 0] == walls_array[:, 2]
+        # merged walls repeat their texture once per face they were made of
+        self._tiles = tiles
+
+    def render_flats(self, hits: Hits, angle: float, pos: tuple[float, float]) -> np.ndarray:
+        """
+        returns an (n_rays, screen_height) array of floor and ceiling pixels behind the walls
+        every row of a column looks at one world point, texture and brightness come from it
+        """
+        n = len(hits.angle)
+        pixels = np.zeros((n, self._h), dtype=np.uint32)
+        if n == 0 or (self._floor is None and self._ceiling is None):
+            return pixels
+
+        res = self._textures.shape[1]
+        rad = np.radians(hits.angle)
+        # texels per unit of row distance along x and y for every column,
+        # row distances are measured to the camera plane like the walls' ones
+        scale = res / self._floor_tile / np.cos(np.radians(angle - hits.angle))
+        tx = np.floor((np.cos(rad) * scale)[:, None] * self._flat_dist[None, :] +
+                      pos[0] * res / self._floor_tile).astype(np.intp) % res
+        ty = np.floor((np.sin(rad) * scale)[:, None] * self._flat_dist[None, :] +
+                      pos[1] * res / self._floor_tile).astype(np.intp) % res
+        texel = ty * res + tx
+        texel += self._flat_levels[None, :] * (res * res)
+
+        # floor rows run down from below the horizon, ceiling rows up from above it
+        first = self._flat_rows[0]
+        if self._floor is not None:
+            pixels[:, first:] = self._floor.ravel()[texel[:, :self._h - first]]
+        if self._ceiling is not None:
+            pixels[:, self._h - first::-1] = self._ceiling.ravel()[texel]
+        return pixels
+
+    def render_columns(self, hits: Hits, angle: float,
+                       pos: tuple[float, float] | None = None) -> np.ndarray:
+        """
+        returns an (n_rays, screen_height) array of pixels with one screen column per ray
+        angle is the view angle the rays were cast with,
+        floor, ceiling and sprites are drawn when the position the rays were cast from is given
+        """
+        n = len(hits.wall)
+        if len(self._tiles) == 0:
+            # no walls to draw, e.g. outside of the streamed chunks, every column sees the flats
+            columns = np.zeros((n, self._h), dtype=np.uint32)
+            inside = np.zeros((n, self._h), dtype=bool)
+        else:
+            columns, inside = self._wall_columns(hits, angle)
+        if pos is None:
+            return columns
+        pixels = self.render_flats(hits, angle, pos)
+        np.copyto(pixels, columns, where=inside)
+        if self.sprites is not None:
+            self.sprites.render(pixels, hits, angle, pos)
+        return pixels
+
+    def _wall_columns(self, hits: Hits, angle: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        returns the (n_rays, screen_height) wall pixels and where the walls cover the column
+        """
+        n = len(hits.wall)
+        res = self._textures.shape[1]
+        hit = hits.wall >= 0
+        wall = np.where(hit, hits.wall, 0)
+
+        # fisheye correction, same as measuring the distance to the camera plane
+        distance = np.where(hit, hits.dist, 1.0) * np.cos(np.radians(angle - hits.angle))
+        distance = np.maximum(0.1, distance)  # Avoid division by zero
+        height = self._h * WALL_HEIGHT / distance
+        brightness = np.clip(1 - distance / self._h, 0, 1).astype(np.float32)
+        brightness[~hit] = 0
+
+        # texture column, mirrored on the faces seen from behind
+        tex_x = np.mod(hits.u * self._tiles[wall], 1.0)
+        x = np.minimum((res * tex_x).astype(np.intp), res - 1)
+        flip = (0 <= angle <= 180) & self._horizontal[wall] |\
+               (90 <= angle <= 270) & self._vertical[wall]
+        x = np.where(flip, res - x - 1, x)
+
+        # shade only the texels of every column, the extra last texel stays black
+        shaded = np.zeros((n, res + 1, 4), dtype=np.uint8)
+        texels = self._textures[self._wall_textures[wall][:, None], np.arange(res)[None, :], x[:, None]]
+        shaded[:, :res, :3] = texels * brightness[:, None, None]
+
+        # texel row for every pixel of every column
+        top = (self._h - height) / 2
+        y = np.floor((self._rows[None, :] - top[:, None]) * res / height[:, None])
+        inside = (y >= 0) & (y < res)
+        y = np.where(inside, y, res).astype(np.intp)
+        y += (np.arange(n) * (res + 1))[:, None]
+        return shaded.view(np.uint32).ravel()[y], inside
+
+    def present(self, columns: np.ndarray) -> np.ndarray:
+        """
+        stretches the columns over the whole framebuffer and returns it
+        """
+        return stretch(columns, self.frame)
+
+    def draw(self, surface: pg.Surface, hits: Hits, angle: float,
+             pos: tuple[float, float] | None = None) -> None:
+        """
+        renders the walls seen by the rays, and floor and ceiling if pos is given,
+        and blits them to the surface
+        """
+        profiler.count("columns_drawn", len(hits.wall))
+        frame = self.present(self.render_columns(hits, angle, pos))
+        surface.blit(pg.image.frombuffer(frame, (self._w, self._h), "RGBX"), (0, 0))
@@ -0,0 +1,149 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame as pg
+from v2 import V2 as v2
+from player import Player, ENGINES
+from render import Renderer
+from dda import GridCaster
+from world import World
+from bench import summarize
+import argparse
+import profiler
+import inputs
+import levels
+import json
+import time
+import util
+import sys
+
+
+STAGES = ("input", "stream", "cast", "collide", "render")
+
+
+def replay(path: str, engine: str = "auto", render: bool = False,
+           frames: int | None = None) -> dict:
+    """
+    plays a trace recorded by main.py --record-input back as fast as possible, without a window
+    every frame takes its recorded dt, so the player ends where it ended in the game
+    returns timings of every stage and the final pose
+    """
+    header, trace = inputs.read_trace(path)
+    w, h = header["screen"]
+
+    world = None
+    grid_caster = None
+    if header["world"]:
+        world = World(header["world"])
+        world.update(*header["spawn"])
+        level = world.get_data()
+        walls = level
+    else:
+        grid = levels.DEFAULT
+        # like the game, with the visible sets only when they are cached
+        level = util.load_map(grid, w, h)
+        walls = level.lines()
+        if engine in ("dda", "auto"):
+            grid_caster = GridCaster(grid, w, h, walls)
+
+    p = Player(v2(*header["spawn"]), walls, fov=header["fov"], rays_number=header["rays"],
+               rotation_speed=header["rotation_speed"], speed=header["speed"],
+               angle=header["angle"], r=header["r"], engine=engine, grid_caster=grid_caster,
+               index=level.index, normals=level.normals, pvs=level.pvs)
+    renderer = Renderer(w, h, walls) if render else None
+    surface = pg.Surface((w, h)) if render else None
+    timings: dict[str, list[float]] = {stage: [] for stage in STAGES}
+
+    try:
+        for n, frame in enumerate(trace):
+            if frames is not None and n >= frames:
+                break
+            profiler.PROFILER.begin_frame()
+            t0 = time.perf_counter()
+            dt_ms, actions, mouse_dx, *rays = frame
+            if rays:
+                p.set_rays_number(rays[0])
+            inputs.apply(p, actions, mouse_dx, dt_ms / 1000)
+
+            t1 = time.perf_counter()
+            if world is not None and world.update(p.get_pos().x, p.get_pos().y):
+                level = world.get_data()
+                walls = level
+                p.set_walls(level)
+                if renderer is not None:
+                    renderer.set_walls(level)
+
+            t2 = time.perf_counter()
+            if header["pipelined"]:
+                p.collide(walls)
+                t3 = time.perf_counter()
+                p.finish_cast()
+                p.submit_cast()
+                t4 = time.perf_counter()
+                timings["collide"].append(t3 - t2)
+                timings["cast"].append(t4 - t3)
+            else:
+                p.cast_rays()
+                t3 = time.perf_counter()
+                p.collide(walls)
+                t4 = time.perf_counter()
+                timings["cast"].append(t3 - t2)
+                timings["collide"].append(t4 - t3)
+
+            if renderer is not None:
+                pos, angle = p.get_hits_pose()
+                renderer.draw(surface, p.get_rays_hits(), angle, (pos.x, pos.y))
+            t5 = time.perf_counter()
+            profiler.PROFILER.end_frame()
+
+            timings["input"].append(t1 - t0)
+            timings["stream"].append(t2 - t1)
+            timings["render"].append(t5 - t4)
+        p.finish_cast()
+    finally:
+        p.close()
+        if world is not None:
+            world.close()
+
+    frame_times = [sum(stage) for stage in zip(*timings.values())]
+    if not frame_times:
+        raise ValueError(f"{path} has no frames")
+    return {
+        "trace": path,
+        "engine": engine,
+        "backend": str(p.get_backend()),
+        "frames": len(frame_times),
+        "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+        "frame": summarize(frame_times),
+        "pose": [p.get_pos().x, p.get_pos().y, p.get_angle()],
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="headless replay of a recorded input trace")
+    parser.add_argument("trace", help="file written by main.py --record-input")
+    parser.add_argument("--engine", choices=ENGINES, default="auto")
+    parser.add_argument("--render", action="store_true", help="render every frame too")
+    parser.add_argument("--frames", type=int, help="stop after this many frames")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="profile every frame and write a chrome trace (.json) or json lines (.jsonl)")
+    parser.add_argument("--output", help="file to write json results to, stdout by default")
+    args = parser.parse_args()
+    profiler.PROFILER.enabled = args.profile is not None
+
+    pg.init()
+    res = replay(args.trace, args.engine, args.render, args.frames)
+    pg.quit()
+    print(f"{res['frames']} frames: {res['frame']['mean']:.2f} ms/frame ({res['backend']})",
+          file=sys.stderr)
+
+    if args.profile:
+        profiler.PROFILER.export(args.profile)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(res, f, indent=2)
+    else:
+        json.dump(res, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from spatial import WallGrid
+import numpy as np
+import caster
+import threading
+import time
+import os
+
+
+# (shared memory name, shape, dtype) of an array living in shared memory
+ArraySpec = tuple[str, tuple[int, ...], str]
+
+_INDEX_META = ("cell", "origin", "shape")
+
+
+def _share(arr: np.ndarray) -> tuple[shared_memory.SharedMemory, np.ndarray, ArraySpec]:
+    """
+    copies an array into a new shared memory block
+    """
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[:] = arr
+    return shm, view, (shm.name, arr.shape, arr.dtype.str)
+
+
+# ---- worker side ----
+
+_ATTACHED: dict[str, tuple[shared_memory.SharedMemory, np.ndarray]] = {}
+_WORKER_INDEX: tuple[tuple, WallGrid] | None = None
+
+def _attach(spec: ArraySpec) -> np.ndarray:
+    name, shape, dtype = spec
+    if name not in _ATTACHED:
+        shm = shared_memory.SharedMemory(name=name)
+        _ATTACHED[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    return _ATTACHED[name][1]
+
+def _detach_others(names: set[str]) -> None:
+    """
+    drops attachments to blocks the parent replaced (grown buffers, new walls)
+    """
+    global _WORKER_INDEX
+    for name in list(_ATTACHED):
+        if name not in names:
+            if _WORKER_INDEX is not None and name in _WORKER_INDEX[0]:
+                _WORKER_INDEX = None
+            shm, view = _ATTACHED.pop(name)
+            del view
+            try:
+                shm.close()
+            except BufferError:
+                # still referenced somewhere, the mapping goes away with the last reference
+                pass
+
+def _worker_cast(task) -> tuple[int, int, float, float]:
+    """
+    casts rays start:stop of the shared input buffer into the shared output buffer
+    returns number of intersection tests, worker pid and start and end time
+    """
+    global _WORKER_INDEX
+    start_time = time.perf_counter()
+    specs, index_meta, subset_size, start, stop = task
+    _detach_others({spec[0] for spec in specs.values()})
+
+    rays = _attach(specs["rays"])[start:stop]
+    out = _attach(specs["hits"])[start:stop]
+    walls = _attach(specs["walls"])
+
+    if index_meta is None:
+        # only the walls in the shared subset buffer, if the parent sent one
+        subset = None if subset_size is None else _attach(specs["subset"])[:subset_size]
+        hits = caster.cast_rays(rays[:, 0], rays[:, 1], rays[:, 2], walls, subset)
+        out[:, 0] = hits.x
+        out[:, 1] = hits.y
+        out[:, 2] = hits.wall
+        out[:, 3] = hits.dist
+        tests = len(rays) * (len(walls) if subset is None else subset_size)
+    else:
+        names = (specs["walls"][0], specs["starts"][0], specs["ids"][0])
+        if _WORKER_INDEX is None or _WORKER_INDEX[0] != names:
+            arrays = dict(index_meta, starts=_attach(specs["starts"]), ids=_attach(specs["ids"]))
+            _WORKER_INDEX = (names, WallGrid.from_arrays(walls, arrays))
+        index = _WORKER_INDEX[1]
+
+        # only walls in the buckets along the ray are tested
+        tests = 0
+        for i, (sx, sy, angle) in enumerate(rays.tolist()):
+            hit = index.cast(sx, sy, angle)
+            tests += index.last_tests
+            out[i] = (0.0, 0.0, -1, np.inf) if hit is None else (hit[0], hit[1], hit[2], hit[3])
+    return tests, os.getpid(), start_time, time.perf_counter()
+
+
+# ---- parent side ----
+
+class SharedRayPool:
+    """
+    persistent process pool exchanging rays and hits through shared memory
+    walls (and the spatial index) are shared once instead of being copied into every worker,
+    every frame only sends tiny (buffer names, start, stop) tasks
+    """
+    def __init__(self, walls: np.ndarray, index: WallGrid | None = None,
+                 max_workers: int | None = None, chunk_size: int = 32) -> None:
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self._blocks: dict[str, shared_memory.SharedMemory] = {}
+        self._views: dict[str, np.ndarray] = {}
+        self._specs: dict[str, ArraySpec] = {}
+        self._index_meta: dict | None = None
+        self._pending: Future | None = None
+        self.last_tasks: list[tuple[int, int, float, float]] = []
+
+        self.set_walls(walls, index)
+        self._reserve(256)
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def _put(self, key: str, arr: np.ndarray) -> None:
+        old = self._blocks.pop(key, None)
+        shm, view, spec = _share(arr)
+        self._blocks[key] = shm
+        self._views[key] = view
+        self._specs[key] = spec
+        if old is not None:
+            old.close()
+            old.unlink()
+
+    def set_walls(self, walls: np.ndarray, index: WallGrid | None = None) -> None:
+        """
+        shares a new set of walls with the workers, they pick it up with the next task
+        """
+        self._wait_pending()
+        self._put("walls", np.asarray(walls, dtype=np.float64).reshape(-1, 4))
+        if index is None:
+            self._index_meta = None
+            for key in ("starts", "ids"):
+                block = self._blocks.pop(key, None)
+                self._specs.pop(key, None)
+                self._views.pop(key, None)
+                if block is not None:
+                    block.close()
+                    block.unlink()
+            return
+
+        arrays = index.arrays()
+        self._index_meta = {key: arrays[key] for key in _INDEX_META}
+        self._put("starts", arrays["starts"])
+        self._put("ids", arrays["ids"])
+
+    def _reserve(self, n: int) -> None:
+        """
+        makes sure the ray buffers can hold n rays
+        """
+        if "rays" in self._views and len(self._views["rays"]) >= n:
+            return
+        capacity = max(n, 2 * len(self._views.get("rays", ())))
+        self._put("rays", np.zeros((capacity, 3)))
+        self._put("hits", np.zeros((capacity, 4)))
+
+    def _share_subset(self, subset: np.ndarray) -> None:
+        """
+        copies wall indices into the shared subset buffer, growing it when needed
+        """
+        if "subset" not in self._views or len(self._views["subset"]) < len(subset):
+            capacity = max(len(subset), 2 * len(self._views.get("subset", ())), 256)
+            self._put("subset", np.zeros(capacity, dtype=np.intp))
+        self._views["subset"][:len(subset)] = subset
+
+    def _wait_pending(self) -> None:
+        # the shared buffers are reused, so a cast has to finish before they are touched
+        if self._pending is not None:
+            wait([self._pending])
+            self._pending = None
+
+    def _collect(self, futures: list, angles: np.ndarray) -> caster.Hits:
+        self.last_tasks = [future.result() for future in futures]
+        n = len(angles)
+        out = self._views["hits"][:n]
+        wall = out[:, 2].astype(np.intp)
+        hits = caster.Hits(angles, out[:, 0].copy(), out[:, 1].copy(), wall,
+                           out[:, 3].copy(), np.zeros(n))
+        if len(self._views["walls"]):
+            hits.u[:] = caster.texture_u(hits.x, hits.y, wall, self._views["walls"])
+        return hits
+
+    def submit(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> Future:
+        """
+        starts casting and returns a future of the hits, asyncio.wrap_future makes it awaitable
+        a new cast waits until the previous one is done
+        subset limits the walls tested to the given indices, workers using the spatial index
+        dont need it and ignore it
+        """
+        self._wait_pending()
+        angles = np.array(angles, dtype=np.float64)
+        n = len(angles)
+        self._reserve(n)
+        rays = self._views["rays"]
+        rays[:n, 0] = starts_x
+        rays[:n, 1] = starts_y
+        rays[:n, 2] = angles
+
+        subset_size = None
+        if subset is not None and self._index_meta is None:
+            self._share_subset(subset)
+            subset_size = len(subset)
+
+        assert self._pool is not None
+        specs = dict(self._specs)
+        tasks = [(specs, self._index_meta, subset_size, i, min(i + self.chunk_size, n))
+                 for i in range(0, n, self.chunk_size)]
+        futures = [self._pool.submit(_worker_cast, task) for task in tasks]
+
+        result: Future = Future()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def chunk_done(_) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            try:
+                result.set_result(self._collect(futures, angles))
+            except BaseException as e:
+                result.set_exception(e)
+
+        if not futures:
+            chunk_done(None)
+        for future in futures:
+            future.add_done_callback(chunk_done)
+        self._pending = result
+        return result
+
+    def cast(self, starts_x, starts_y, angles, subset: np.ndarray | None = None) -> caster.Hits:
+        """
+        casts the rays on the workers and waits for the hits
+        """
+        return self.submit(starts_x, starts_y, angles, subset).result()
+
+    def close(self) -> None:
+        """
+        shuts the workers down and frees the shared memory
+        """
+        self._wait_pending()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self._views.clear()
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks.clear()
@@ -0,0 +1,245 @@
+from caster import RAY_LENGTH, intersect_ray_segment
+import numpy as np
+import math
+
+
+class WallGrid:
+    """
+    uniform grid of buckets over wall segments
+    every bucket stores indices of the walls whose bounding box overlaps it
+    """
+    def __init__(self, walls: np.ndarray, cell: float | None = None) -> None:
+        """
+        walls is an (n, 4) array of x1, y1, x2, y2 as made by caster.walls_to_array
+        """
+        self.walls = np.asarray(walls, dtype=np.float64).reshape(-1, 4)
+        self._buckets: list[tuple[int, ...]] | None = None
+        self._walls_tuples: list[tuple[float, ...]] = []
+        self.last_tests = 0
+
+        if len(self.walls) == 0:
+            self.cell = cell or 1.0
+            self.origin = np.zeros(2)
+            self.shape = (1, 1)
+            self.starts = np.zeros(2, dtype=np.intp)
+            self.ids = np.zeros(0, dtype=np.intp)
+            return
+
+        if cell is None:
+            lengths = np.hypot(self.walls[:, 2] - self.walls[:, 0],
+                               self.walls[:, 3] - self.walls[:, 1])
+            cell = max(2 * float(np.median(lengths)), 1.0)
+        self.cell = float(cell)
+
+        lo = np.minimum(self.walls[:, :2], self.walls[:, 2:])
+        hi = np.maximum(self.walls[:, :2], self.walls[:, 2:])
+        self.origin = lo.min(axis=0)
+        size = hi.max(axis=0) - self.origin
+        cols = int(size[0] // self.cell) + 1
+        rows = int(size[1] // self.cell) + 1
+        self.shape = (rows, cols)
+
+        c_lo = ((lo - self.origin) // self.cell).astype(np.intp)
+        c_hi = ((hi - self.origin) // self.cell).astype(np.intp)
+        # one (bucket, wall) pair per bucket of every wall's bounding box
+        nx = c_hi[:, 0] - c_lo[:, 0] + 1
+        ny = c_hi[:, 1] - c_lo[:, 1] + 1
+        counts = nx * ny
+        ids = np.repeat(np.arange(len(self.walls), dtype=np.intp), counts)
+        k = np.arange(len(ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (c_lo[ids, 1] + k // nx[ids]) * cols + c_lo[ids, 0] + k % nx[ids]
+
+        # csr layout: walls of bucket k are ids[starts[k]:starts[k + 1]]
+        order = np.lexsort((ids, cells))
+        self.ids = ids[order]
+        counts = np.bincount(cells, minlength=rows * cols)
+        self.starts = np.concatenate(([0], np.cumsum(counts))).astype(np.intp)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_buckets"] = None
+        state["_walls_tuples"] = []
+        return state
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+        returns the index as plain arrays, walls are not included
+        """
+        return {"cell": np.array(self.cell), "origin": self.origin,
+                "shape": np.array(self.shape), "starts": self.starts, "ids": self.ids}
+
+    @classmethod
+    def from_arrays(cls, walls: np.ndarray, arrays: dict[str, np.ndarray]) -> "WallGrid":
+        """
+        rebuilds an index from the output of arrays without recomputing the buckets
+        """
+        res = cls.__new__(cls)
+        res.walls = walls
+        res.cell = float(arrays["cell"])
+        res.origin = np.asarray(arrays["origin"])
+        res.shape = tuple(int(v) for v in arrays["shape"])
+        res.starts = arrays["starts"]
+        res.ids = arrays["ids"]
+        res._buckets = None
+        res._walls_tuples = []
+        res.last_tests = 0
+        return res
+
+    def _get_buckets(self) -> list[tuple[int, ...]]:
+        # plain python view of the buckets, the scalar traversal is much faster on it
+        if self._buckets is None:
+            ids = self.ids.tolist()
+            starts = self.starts.tolist()
+            self._buckets = [tuple(ids[starts[k]:starts[k + 1]]) for k in range(len(starts) - 1)]
+            self._walls_tuples = [tuple(w) for w in self.walls.tolist()]
+        return self._buckets
+
+    def query_radius(self, x: float, y: float, r: float) -> list[int]:
+        """
+        returns sorted indices of the walls that may be closer than r to the point
+        """
+        rows, cols = self.shape
+        ox, oy = self.origin
+        c_lo = max(int((x - r - ox) // self.cell), 0)
+        c_hi = min(int((x + r - ox) // self.cell), cols - 1)
+        r_lo = max(int((y - r - oy) // self.cell), 0)
+        r_hi = min(int((y + r - oy) // self.cell), rows - 1)
+
+        buckets = self._get_buckets()
+        res = set()
+        for row in range(r_lo, r_hi + 1):
+            for col in range(c_lo, c_hi + 1):
+                res.update(buckets[row * cols + col])
+        return sorted(res)
+
+    def cast(self, sx: float, sy: float, angle: float) -> None | tuple[float, float, int, float]:
+        """
+        walks the buckets along the ray and returns the closest hit
+        as (x, y, wall_index, dist), or None if the ray didnt hit anything
+        number of walls tested is left in last_tests
+        """
+        buckets = self._get_buckets()
+        walls = self._walls_tuples
+        rows, cols = self.shape
+        cell = self.cell
+        ox, oy = self.origin
+
+        rad = angle * math.pi / 180.0
+        dx = math.cos(rad)
+        dy = math.sin(rad)
+        ex = sx + dx * RAY_LENGTH
+        ey = sy + dy * RAY_LENGTH
+
+        self.last_tests = 0
+
+        # clip the ray to the grid bounds (slab test), rays starting outside get moved in
+        t_in, t_out = 0.0, RAY_LENGTH
+        for s, d, lo, hi in ((sx, dx, ox, ox + cols * cell), (sy, dy, oy, oy + rows * cell)):
+            if abs(d) < 1e-12:
+                if s < lo or s > hi:
+                    return None
+                continue
+            t1 = (lo - s) / d
+            t2 = (hi - s) / d
+            t_in = max(t_in, min(t1, t2))
+            t_out = min(t_out, max(t1, t2))
+        if t_in > t_out:
+            return None
+
+        px = sx + dx * t_in - ox
+        py = sy + dy * t_in - oy
+        col = min(max(int(px // cell), 0), cols - 1)
+        row = min(max(int(py // cell), 0), rows - 1)
+        step_col = 1 if dx > 0 else -1
+        step_row = 1 if dy > 0 else -1
+        delta_col = abs(cell / dx) if dx != 0 else math.inf
+        delta_row = abs(cell / dy) if dy != 0 else math.inf
+        if dx > 0:
+            side_col = t_in + ((col + 1) * cell - px) / dx
+        elif dx < 0:
+            side_col = t_in + (col * cell - px) / dx
+        else:
+            side_col = math.inf
+        if dy > 0:
+            side_row = t_in + ((row + 1) * cell - py) / dy
+        elif dy < 0:
+            side_row = t_in + (row * cell - py) / dy
+        else:
+            side_row = math.inf
+
+        best = None
+        best_dist = math.inf
+        tested = set()
+        while 0 <= col < cols and 0 <= row < rows:
+            for idx in buckets[row * cols + col]:
+                if idx in tested:
+                    continue
+                tested.add(idx)
+                pt = intersect_ray_segment(sx, sy, ex, ey, *walls[idx])
+                if pt is None:
+                    continue
+                d = math.hypot(pt[0] - sx, pt[1] - sy)
+                if d < best_dist:
+                    best_dist = d
+                    best = (pt[0], pt[1], idx, d)
+
+            # nothing further along the ray can be closer than a hit inside this bucket
+            exit_t = min(side_col, side_row)
+            if best_dist <= exit_t or exit_t > t_out:
+                break
+            if side_col < side_row:
+                side_col += delta_col
+                col += step_col
+            else:
+                side_row += delta_row
+                row += step_row
+        self.last_tests = len(tested)
+        return best
+
+
+class PointGrid:
+    """
+    uniform grid of buckets over points, in the same csr layout as WallGrid
+    built with a single sort, so it is cheap to rebuild when the points move
+    """
+    def __init__(self, points: np.ndarray, cell: float) -> None:
+        """
+        points is an (n, 2) array of x, y
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell = float(cell)
+        if len(points) == 0:
+            self.origin = np.zeros(2)
+            self.shape = (1, 1)
+            self.starts = np.zeros(2, dtype=np.intp)
+            self.ids = np.zeros(0, dtype=np.intp)
+            return
+
+        self.origin = points.min(axis=0)
+        c = ((points - self.origin) // self.cell).astype(np.intp)
+        cols = int(c[:, 0].max()) + 1
+        rows = int(c[:, 1].max()) + 1
+        self.shape = (rows, cols)
+
+        # csr layout: points of bucket k are ids[starts[k]:starts[k + 1]]
+        cells = c[:, 1] * cols + c[:, 0]
+        self.ids = np.argsort(cells, kind="stable").astype(np.intp)
+        counts = np.bincount(cells, minlength=rows * cols)
+        self.starts = np.concatenate(([0], np.cumsum(counts))).astype(np.intp)
+
+    def query_box(self, x1: float, y1: float, x2: float, y2: float) -> np.ndarray:
+        """
+        returns indices of the points in the buckets overlapping the box, a few may be outside it
+        """
+        rows, cols = self.shape
+        ox, oy = self.origin
+        c_lo = max(int((x1 - ox) // self.cell), 0)
+        c_hi = min(int((x2 - ox) // self.cell), cols - 1)
+        r_lo = max(int((y1 - oy) // self.cell), 0)
+        r_hi = min(int((y2 - oy) // self.cell), rows - 1)
+        if c_lo > c_hi or r_lo > r_hi:
+            return np.zeros(0, dtype=np.intp)
+
+        # buckets of one grid row are next to each other, one slice per row
+        return np.concatenate([self.ids[self.starts[row * cols + c_lo]:self.starts[row * cols + c_hi + 1]]
+                               for row in range(r_lo, r_hi + 1)])
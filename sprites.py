@@ -0,0 +1,276 @@
+from typing import Iterator
+from caster import Hits
+from render import WALL_HEIGHT, get_texture, shade_table
+from spatial import PointGrid
+from v2 import V2 as v2
+import numpy as np
+import constants
+import profiler
+
+
+# sprites closer than this to the camera plane are not drawn
+NEAR = 1.0
+
+
+class Sprite:
+    """
+    handle to one sprite of a SpriteSet, its data stays in the set's arrays
+    """
+    def __init__(self, sprites: "SpriteSet", index: int) -> None:
+        self._sprites = sprites
+        self.index = index
+
+    def get_pos(self) -> v2:
+        return v2(float(self._sprites.x[self.index]), float(self._sprites.y[self.index]))
+
+    def get_size(self) -> float:
+        return float(self._sprites.size[self.index])
+
+
+class SpriteSet:
+    """
+    billboard sprites standing on the floor, stored as arrays with one entry per sprite
+    so thousands of them are culled, projected and depth tested without a loop over sprites
+    size is the width and height of a sprite in world units,
+    texels of the color constants.TRANSPARENT are not drawn
+    """
+    def __init__(self, cell: float = 128) -> None:
+        self._cell = cell
+        self._count = 0
+        self.x = np.zeros(0, dtype=np.float64)
+        self.y = np.zeros(0, dtype=np.float64)
+        self.size = np.zeros(0, dtype=np.float64)
+        self.texture = np.zeros(0, dtype=np.intp)
+        self.alive = np.zeros(0, dtype=bool)
+
+        self._texture_names: list[str] = []
+        self._tables: np.ndarray | None = None
+        self._opaque: np.ndarray | None = None
+        self._spans: np.ndarray | None = None
+        self._grid: PointGrid | None = None
+        self._grid_ids = np.zeros(0, dtype=np.intp)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.alive))
+
+    def __iter__(self) -> Iterator[Sprite]:
+        for i in np.flatnonzero(self.alive):
+            yield Sprite(self, int(i))
+
+    def _texture_id(self, name: str) -> int:
+        if name not in self._texture_names:
+            self._texture_names.append(name)
+            self._tables = None
+        return self._texture_names.index(name)
+
+    def _grow(self, n: int) -> None:
+        """
+        makes room for n more sprites, the arrays double so adding one at a time stays cheap
+        """
+        if self._count + n <= len(self.x):
+            return
+        capacity = max(2 * len(self.x), self._count + n, 16)
+        for name in ("x", "y", "size", "texture", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add_many(self, xs: np.ndarray, ys: np.ndarray, texture: str,
+                 size: float | np.ndarray = 50) -> np.ndarray:
+        """
+        adds sprites of one texture at the given positions, returns their ids
+        """
+        xs = np.asarray(xs, dtype=np.float64).ravel()
+        ys = np.asarray(ys, dtype=np.float64).ravel()
+        n = len(xs)
+        texture_id = self._texture_id(texture)
+        self._grow(n)
+        ids = np.arange(self._count, self._count + n)
+        self.x[ids] = xs
+        self.y[ids] = ys
+        self.size[ids] = size
+        self.texture[ids] = texture_id
+        self.alive[ids] = True
+        self._count += n
+        self._grid = None
+        return ids
+
+    def add(self, pos: v2, texture: str, size: float = 50) -> Sprite:
+        return Sprite(self, int(self.add_many([pos.x], [pos.y], texture, size)[0]))
+
+    def remove(self, ids: np.ndarray | int) -> None:
+        self.alive[ids] = False
+        self._grid = None
+
+    def move(self, ids: np.ndarray | int, xs: np.ndarray | float, ys: np.ndarray | float) -> None:
+        """
+        moves the sprites, the index is rebuilt with one sort the next time it is queried
+        """
+        self.x[ids] = xs
+        self.y[ids] = ys
+        self._grid = None
+
+    def _index(self) -> PointGrid:
+        if self._grid is None:
+            self._grid_ids = np.flatnonzero(self.alive)
+            points = np.column_stack((self.x[self._grid_ids], self.y[self._grid_ids]))
+            self._grid = PointGrid(points, self._cell)
+        return self._grid
+
+    def _shading(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        returns the (n_textures, 256, res * res) pre-shaded texels of the sprites' textures,
+        which texels are not transparent and the (n_textures, res, 2) first and past the last
+        opaque row of every texture column, both 0 in columns without opaque texels
+        """
+        if self._tables is None or self._opaque is None or self._spans is None:
+            textures = [get_texture(name) for name in self._texture_names]
+            opaque = np.stack([np.any(texture != constants.TRANSPARENT, axis=-1)
+                               for texture in textures])
+            res = opaque.shape[1]
+            filled = opaque.any(axis=1)
+            first = np.where(filled, opaque.argmax(axis=1), 0)
+            last = np.where(filled, res - opaque[:, ::-1].argmax(axis=1), 0)
+            self._tables = np.stack([shade_table(texture) for texture in textures])
+            self._opaque = opaque.reshape(len(textures), -1)
+            self._spans = np.stack((first, last), axis=-1)
+        return self._tables, self._opaque, self._spans
+
+    def visible(self, x: float, y: float, angle: float, fov: float, max_dist: float) -> np.ndarray:
+        """
+        returns ids of the sprites inside the view cone, at most max_dist away
+        only the grid buckets around the cone are looked at
+        """
+        if not self.alive.any():
+            return np.zeros(0, dtype=np.intp)
+        grid = self._index()
+        pad = float(self.size[self._grid_ids].max()) / 2
+
+        # bounding box of the cone, its arc bulges out where it crosses the axes
+        lo, hi = angle - fov / 2, angle + fov / 2
+        axes = np.arange(np.ceil(lo / 90), np.floor(hi / 90) + 1) * 90
+        edges = np.radians(np.concatenate(([lo, hi], axes)))
+        xs = np.append(x + np.cos(edges) * max_dist, x)
+        ys = np.append(y + np.sin(edges) * max_dist, y)
+        ids = self._grid_ids[grid.query_box(xs.min() - pad, ys.min() - pad,
+                                            xs.max() + pad, ys.max() + pad)]
+        ids = ids[self.alive[ids]]
+
+        dx = self.x[ids] - x
+        dy = self.y[ids] - y
+        dist = np.hypot(dx, dy)
+        half = self.size[ids] / 2
+        off = np.abs((np.degrees(np.arctan2(dy, dx)) - angle + 180) % 360 - 180)
+        # a sprite is visible while any part of its width is in the cone
+        spread = np.degrees(np.arctan2(half, np.maximum(dist, 1e-9)))
+        return ids[(dist <= max_dist + half) & (off <= fov / 2 + spread)]
+
+    def render(self, pixels: np.ndarray, hits: Hits, angle: float,
+               pos: tuple[float, float]) -> int:
+        """
+        draws the sprites seen by the rays into the (n_rays, screen_height) pixels
+        a sprite column is drawn only where it is closer than the wall the ray hit,
+        overlapping sprites are resolved per pixel by their distance
+        returns how many sprites were drawn
+        """
+        n, h = pixels.shape
+        if n < 2:
+            return 0
+        first = hits.angle[0]
+        step = ((hits.angle[-1] - first) % 360) / (n - 1)
+        if step <= 0:
+            return 0
+
+        with profiler.scope("sprites cull"):
+            ids = self.visible(pos[0], pos[1], angle, step * (n - 1), h)
+            rad = np.radians(angle)
+            dx = self.x[ids] - pos[0]
+            dy = self.y[ids] - pos[1]
+            # distance to the camera plane, the same depth the walls are drawn with,
+            # sprites beyond h are shaded to black like the walls
+            z = dx * np.cos(rad) + dy * np.sin(rad)
+            near = (z > NEAR) & (z < h)
+            ids, dx, dy, z = ids[near], dx[near], dy[near], z[near]
+            if len(ids) == 0:
+                return 0
+
+            # columns covered by every sprite
+            rel = (np.degrees(np.arctan2(dy, dx)) - first + 180) % 360 - 180
+            half = np.degrees(np.arctan2(self.size[ids] / 2, np.hypot(dx, dy)))
+            c0 = np.maximum(np.ceil((rel - half) / step), 0).astype(np.intp)
+            c1 = np.minimum(np.floor((rel + half) / step), n - 1).astype(np.intp)
+            on_screen = c0 <= c1
+            ids, z, rel, half, c0, c1 = (a[on_screen] for a in (ids, z, rel, half, c0, c1))
+            profiler.count("sprites_visible", len(ids))
+
+        with profiler.scope("sprites draw"):
+            # one (sprite, column) pair per column of every sprite
+            counts = c1 - c0 + 1
+            s = np.repeat(np.arange(len(ids)), counts)
+            col = c0[s] + np.arange(len(s)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+            # the walls' depth buffer, a column without a hit hides nothing
+            depth = np.where(hits.wall >= 0,
+                             hits.dist * np.cos(np.radians(angle - hits.angle)), np.inf)
+            front = z[s] < depth[col]
+            s, col = s[front], col[front]
+            if len(s) == 0:
+                return 0
+
+            tables, opaque, spans = self._shading()
+            res = spans.shape[1]
+            u = (col * step - rel[s] + half[s]) / (2 * half[s])
+            tx = np.clip((u * res).astype(np.intp), 0, res - 1)
+
+            # rows of every pair, sprites stand on the floor, only the rows between the first
+            # and the last opaque texel of the texture column are looked at
+            texture = self.texture[ids][s]
+            bottom = h / 2 + h * WALL_HEIGHT / (2 * z)
+            height = h * self.size[ids] / z
+            top = (bottom - height)[s]
+            span = spans[texture, tx]
+            scale = (height / res)[s]
+            r0 = np.clip(np.ceil(top + span[:, 0] * scale), 0, h).astype(np.intp)
+            r1 = np.clip(np.ceil(top + span[:, 1] * scale), 0, h).astype(np.intp)
+            counts = np.maximum(r1 - r0, 0)
+
+            # everything that only depends on the pair is worked out once per pair,
+            # the pixels then only add their texture row to it
+            level = (np.clip(1 - z / h, 0, 1) * 255).astype(np.intp)[s]
+            texel = texture * res * res + tx
+            shaded = (texture * 256 + level) * res * res + tx
+            pair = np.repeat(np.arange(len(s)), counts)
+            row = np.arange(len(pair)) + np.repeat(r0 - np.cumsum(counts) + counts, counts)
+            ty = ((row - top[pair]) / scale[pair]).astype(np.intp)
+            np.clip(ty, 0, res - 1, out=ty)
+            ty *= res
+
+            keep = opaque.ravel()[texel[pair] + ty]
+            pair, row, ty = pair[keep], row[keep], ty[keep]
+            colors = tables.ravel()[shaded[pair] + ty]
+
+            # nearest sprite wins every pixel
+            flat = col[pair] * h + row
+            dist = z[s][pair]
+            zbuffer = np.full(n * h, np.inf)
+            np.minimum.at(zbuffer, flat, dist)
+            nearest = dist == zbuffer[flat]
+            pixels.ravel()[flat[nearest]] = colors[nearest]
+        return len(np.unique(s))
+
+
+def scatter(grid: list[str], cell: tuple[int, int], n: int,
+            seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    returns n random positions inside the empty cells of the grid
+    the same seed always gives the same positions
+    """
+    rng = np.random.default_rng(seed)
+    empty = np.argwhere(np.array([list(row) for row in grid]) == " ")
+    if len(empty) == 0:
+        raise Exception("grid has no empty cells")
+    cells = empty[rng.integers(len(empty), size=n)]
+    # keep a margin so sprites do not stick into the walls around their cell
+    offset = rng.uniform(0.25, 0.75, size=(n, 2))
+    return (cells[:, 1] + offset[:, 0]) * cell[0], (cells[:, 0] + offset[:, 1]) * cell[1]
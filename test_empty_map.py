@@ -0,0 +1,32 @@
+from map_cache import MapData
+from player import Player
+from render import Renderer
+from sprites import SpriteSet
+from v2 import V2 as v2
+import numpy as np
+import pytest
+
+
+def empty_map() -> MapData:
+    # what the world streams in once the player walks out of the loaded chunks
+    return MapData(np.zeros((0, 4)), np.zeros(0, dtype=np.intp), [], np.zeros((0, 2)), (64, 64))
+
+
+@pytest.mark.parametrize("engine", ["numpy", "serial", "shapely", "thread", "process"])
+def test_cast_and_render_without_walls(engine: str) -> None:
+    level = empty_map()
+    p = Player(v2(100, 100), level, rays_number=32, engine=engine, cache_rays=False)
+    try:
+        p.cast_rays()
+        hits = p.get_rays_hits()
+    finally:
+        p.close()
+    assert (hits.wall == -1).all()
+    assert np.isinf(hits.dist).all()
+
+    sprites = SpriteSet()
+    sprites.add_many([200], [100], "orb")
+    renderer = Renderer(320, 200, level, sprites=sprites)
+    assert not renderer.render_columns(hits, 0).any()
+    # the floor, ceiling and the sprite are still drawn
+    assert renderer.render_columns(hits, 0, (100, 100)).any()
@@ -1,33 +1,69 @@
 from line import Line
-from v2 import V2 as v2
-import _pickle as pl
+from map_cache import MapData, MapCache, cache_key
+from spatial import WallGrid
+import numpy as np
+import dda
+import pvs as visibility
 
 
-def generate_map(grid: list[str], w: int, h: int) -> list[Line]:
-    try:
-        with open("map.pkl", "rb") as f:
-            try:
-                res = pl.load(f)
-                return res
-            except EOFError:
-                pass
-    except OSError:
-        pass
+def cell_size(grid: list[str], w: int, h: int) -> tuple[int, int]:
+    """
+    returns width and height of one grid cell in world units
+    """
+    return w // len(grid[0]) + 1, h // len(grid) + 1
 
-    if not grid:
-        raise Exception("grid is empty")
+def merge_collinear(walls: np.ndarray, textures: np.ndarray,
+                    normals: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    joins axis aligned walls that continue each other on one line, with the same texture
+    and facing, into single walls
+    returns the merged walls, textures and normals and how many walls each one is made of
+    """
+    horizontal = walls[:, 1] == walls[:, 3]
+    vertical = walls[:, 0] == walls[:, 2]
+    # coordinate fixed along the wall and the one running along it
+    fixed = np.where(horizontal, walls[:, 1], walls[:, 0])
+    along = np.where(horizontal, walls[:, 0], walls[:, 1])
+    order = np.lexsort((along, fixed, textures, normals[:, 1], normals[:, 0], horizontal))
 
-    grid_w = len(grid[0])
-    for row in grid:
-        if len(row) != grid_w:
-            raise Exception("grid is not a rectangle")
+    aligned = horizontal | vertical
+    merged: list[list[float]] = []
+    first: list[int] = []
+    tiles: list[int] = []
+    for i in order.tolist():
+        wall = walls[i].tolist()
+        if merged and aligned[i]:
+            j = first[-1]
+            if (aligned[j] and horizontal[i] == horizontal[j] and fixed[i] == fixed[j]
+                    and textures[i] == textures[j] and (normals[i] == normals[j]).all()
+                    and merged[-1][2:] == wall[:2]):
+                merged[-1][2:] = wall[2:]
+                tiles[-1] += 1
+                continue
+        merged.append(wall)
+        first.append(i)
+        tiles.append(1)
+
+    return (np.array(merged, dtype=np.float64).reshape(-1, 4),
+            textures[first],
+            normals[first].reshape(-1, 2),
+            np.array(tiles, dtype=np.float64))
 
-    res = []
+def build_faces(grid: list[str], cell: tuple[int, int], rows: range, cols: range,
+                texture_names: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    returns the merged walls, textures, normals and tiles of the wall cells in rows x cols,
+    faces between them and empty cells outside of the region are included too,
+    textures index into texture_names, new names are appended to it
+    """
+    walls = []
+    textures = []
+    normals = []
+    grid_w = len(grid[0])
     grid_h = len(grid)
-    wall_len_h = w // grid_w + 1
-    wall_len_v = h // grid_h + 1
-    for i in range(grid_h):
-        for j in range(grid_w):
+    wall_len_h, wall_len_v = cell
+    for i in rows:
+        for j in cols:
             texture_name = ""
             match grid[i][j]:
                 case " ":
@@ -37,24 +73,77 @@ def generate_map(grid: list[str], w: int, h: int) -> list[Line]:
                 case "w":
                     texture_name = ""
 
+            if texture_name not in texture_names:
+                texture_names.append(texture_name)
+            texture = texture_names.index(texture_name)
+
+            x1, y1 = j * wall_len_h, i * wall_len_v
+            x2, y2 = (j + 1) * wall_len_h, (i + 1) * wall_len_v
             if i - 1 >= 0 and grid[i - 1][j] == " ":
-                res.append(Line(v2(j * wall_len_h, i * wall_len_v),
-                                v2((j + 1) * wall_len_h, i * wall_len_v),
-                                texture_name=texture_name))
+                walls.append((x1, y1, x2, y1))
+                normals.append((0, -1))
+                textures.append(texture)
             if i + 1 < grid_h and grid[i + 1][j] == " ":
-                res.append(Line(v2(j * wall_len_h, (i + 1) * wall_len_v),
-                                v2((j + 1) * wall_len_h, (i + 1) * wall_len_v),
-                                texture_name=texture_name))
+                walls.append((x1, y2, x2, y2))
+                normals.append((0, 1))
+                textures.append(texture)
 
             if j - 1 >= 0 and grid[i][j - 1] == " ":
-                res.append(Line(v2(j * wall_len_h, i * wall_len_v),
-                                v2(j * wall_len_h, (i + 1) * wall_len_v),
-                                texture_name=texture_name))
+                walls.append((x1, y1, x1, y2))
+                normals.append((-1, 0))
+                textures.append(texture)
             if j + 1 < grid_w and grid[i][j + 1] == " ":
-                res.append(Line(v2((j + 1) * wall_len_h, i * wall_len_v),
-                                v2((j + 1) * wall_len_h, (i + 1) * wall_len_v),
-                                texture_name=texture_name))
-    with open("map.pkl", "wb") as f:
-        pl.dump(res, f, -1)
+                walls.append((x2, y1, x2, y2))
+                normals.append((1, 0))
+                textures.append(texture)
+
+    return merge_collinear(np.array(walls, dtype=np.float64).reshape(-1, 4),
+                           np.array(textures, dtype=np.int32),
+                           np.array(normals, dtype=np.float64).reshape(-1, 2))
 
-    return res
+def check_grid(grid: list[str]) -> None:
+    if not grid:
+        raise Exception("grid is empty")
+
+    grid_w = len(grid[0])
+    for row in grid:
+        if len(row) != grid_w:
+            raise Exception("grid is not a rectangle")
+
+def build_map(grid: list[str], w: int, h: int) -> MapData:
+    """
+    turns every face between a wall cell and an empty cell into a wall,
+    faces continuing each other are merged into one long wall
+    """
+    check_grid(grid)
+    cell = cell_size(grid, w, h)
+    texture_names: list[str] = []
+    walls, textures, normals, tiles = build_faces(grid, cell, range(len(grid)),
+                                                  range(len(grid[0])), texture_names)
+
+    # buckets as big as before merging, long walls just span more of them
+    index = WallGrid(walls, cell=2 * max(cell))
+    return MapData(walls, textures, texture_names, normals, cell, index=index, tiles=tiles)
+
+def load_map(grid: list[str], w: int, h: int, cache: MapCache | None = None,
+             pvs: bool = False) -> MapData:
+    """
+    returns the map for the grid, generating and caching it on the first call
+    cached potentially visible sets are always loaded, with pvs they are built
+    when missing, that can take a while
+    """
+    cache = cache if cache is not None else MapCache()
+    key = cache_key(grid, w, h)
+    data = cache.get(key)
+    if data is None:
+        data = build_map(grid, w, h)
+        if not pvs:
+            cache.put(key, data)
+    if pvs and data.pvs is None:
+        grid_caster = dda.GridCaster(grid, w, h, data.lines())
+        data.pvs = visibility.build_pvs(grid, grid_caster, data.cell, data.walls)
+        cache.put(key, data)
+    return data
+
+def generate_map(grid: list[str], w: int, h: int) -> list[Line]:
+    return load_map(grid, w, h).lines()
@@ -0,0 +1,213 @@
+from line import Line
+from map_cache import MapData, GENERATOR_VERSION
+from spatial import WallGrid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import profiler
+import levels
+import json
+import util
+import os
+
+
+# walls of chunks that are no longer around the player stay loaded up to this many bytes
+MAX_CACHED_BYTES = 64 * 2 ** 20
+
+_ARRAYS = ("walls", "textures", "normals", "tiles")
+_EMPTY = {"walls": np.zeros((0, 4)), "textures": np.zeros(0, dtype=np.int32),
+          "normals": np.zeros((0, 2)), "tiles": np.zeros(0)}
+
+
+def build_world(grid: list[str], cell: tuple[int, int], directory: str, tile: int = 32) -> None:
+    """
+    splits the grid into chunks of tile x tile cells and writes the walls of every chunk
+    to its own file in the directory, empty chunks get no file
+    only the walls of one chunk are in memory at a time
+    """
+    util.check_grid(grid)
+    grid_h, grid_w = len(grid), len(grid[0])
+    rows, cols = -(-grid_h // tile), -(-grid_w // tile)
+    os.makedirs(directory, exist_ok=True)
+
+    texture_names: list[str] = []
+    counts = np.zeros((rows, cols), dtype=np.intp)
+    with profiler.scope("build world"):
+        for ti in range(rows):
+            for tj in range(cols):
+                walls, textures, normals, tiles = util.build_faces(
+                    grid, cell, range(ti * tile, min((ti + 1) * tile, grid_h)),
+                    range(tj * tile, min((tj + 1) * tile, grid_w)), texture_names)
+                counts[ti, tj] = len(walls)
+                if len(walls):
+                    np.savez(os.path.join(directory, f"chunk_{ti}_{tj}.npz"), walls=walls,
+                             textures=textures, normals=normals, tiles=tiles)
+
+    np.save(os.path.join(directory, "counts.npy"), counts)
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump({"version": GENERATOR_VERSION, "cell": list(cell), "tile": tile,
+                   "size": [grid_w, grid_h], "texture_names": texture_names,
+                   "spawn": list(levels.spawn_point(grid, cell))}, f)
+
+
+class World:
+    """
+    level written by build_world, its chunks are loaded from disk only when needed
+    the chunks within radius of the chunk the player is in are resident,
+    those are the walls the player sees and collides with,
+    chunks left behind stay cached until max_bytes is exceeded, least recently used go first
+    chunks are loaded and joined on a background thread, the old walls stay resident
+    until the new ones are ready, the radius leaves the player plenty of them meanwhile
+    """
+    def __init__(self, directory: str, radius: int = 2, max_bytes: int = MAX_CACHED_BYTES) -> None:
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != GENERATOR_VERSION:
+            raise ValueError(f"world in {directory} was built by another map generator, rebuild it")
+
+        self._directory = directory
+        self._radius = radius
+        self._max_bytes = max_bytes
+        self.cell: tuple[int, int] = tuple(meta["cell"])
+        self.tile: int = meta["tile"]
+        self.spawn: tuple[float, float] = tuple(meta["spawn"])
+        self.texture_names: list[str] = meta["texture_names"]
+        self._counts = np.load(os.path.join(directory, "counts.npy"))
+        self._chunk_size = (self.tile * self.cell[0], self.tile * self.cell[1])
+
+        self._cache: OrderedDict[tuple[int, int], dict[str, np.ndarray]] = OrderedDict()
+        self._cached_bytes = 0
+        self._resident: tuple[tuple[int, int], ...] | None = None
+        self._data: MapData | None = None
+        self._lines: list[Line] | None = None
+        self.loads = 0
+        # chunks being made resident, only the loader thread touches the chunk cache
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: tuple[tuple[tuple[int, int], ...], Future[MapData]] | None = None
+
+    def chunk_at(self, x: float, y: float) -> tuple[int, int]:
+        """
+        returns row and column of the chunk containing the point
+        """
+        return int(y // self._chunk_size[1]), int(x // self._chunk_size[0])
+
+    def _chunks_around(self, x: float, y: float) -> tuple[tuple[int, int], ...]:
+        rows, cols = self._counts.shape
+        ci, cj = self.chunk_at(x, y)
+        return tuple((i, j)
+                     for i in range(max(ci - self._radius, 0), min(ci + self._radius + 1, rows))
+                     for j in range(max(cj - self._radius, 0), min(cj + self._radius + 1, cols))
+                     if self._counts[i, j])
+
+    def _chunk(self, key: tuple[int, int]) -> dict[str, np.ndarray]:
+        chunk = self._cache.get(key)
+        if chunk is not None:
+            self._cache.move_to_end(key)
+            return chunk
+
+        with profiler.scope("load chunk"):
+            with np.load(os.path.join(self._directory, f"chunk_{key[0]}_{key[1]}.npz")) as f:
+                chunk = {name: f[name] for name in _ARRAYS}
+        self.loads += 1
+        self._cache[key] = chunk
+        self._cached_bytes += sum(arr.nbytes for arr in chunk.values())
+        return chunk
+
+    def _evict(self, keep: tuple[tuple[int, int], ...]) -> None:
+        for key in list(self._cache):
+            if self._cached_bytes <= self._max_bytes:
+                break
+            if key in keep:
+                continue
+            chunk = self._cache.pop(key)
+            self._cached_bytes -= sum(arr.nbytes for arr in chunk.values())
+
+    def _load(self, keys: tuple[tuple[int, int], ...]) -> MapData:
+        """
+        joins the chunks into one map, runs on the loader thread
+        """
+        with profiler.scope("stream chunks"):
+            chunks = [self._chunk(key) for key in keys]
+            self._evict(keys)
+            arrays = {name: np.concatenate([_EMPTY[name], *(chunk[name] for chunk in chunks)])
+                      for name in _ARRAYS}
+            index = WallGrid(arrays["walls"], cell=2 * max(self.cell))
+            return MapData(arrays["walls"], arrays["textures"], self.texture_names,
+                           arrays["normals"], self.cell, index=index, tiles=arrays["tiles"])
+
+    def update(self, x: float, y: float, wait: bool = False) -> bool:
+        """
+        starts making the chunks around the point resident
+        the first call, and every call with wait, blocks until they are
+        returns True if the resident walls changed, they then have to be passed on again
+        """
+        keys = self._chunks_around(x, y)
+        if keys != self._resident and self._pending is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="world")
+            self._pending = (keys, self._executor.submit(self._load, keys))
+
+        if self._pending is None:
+            return False
+        pending_keys, future = self._pending
+        if not future.done() and not wait and self._data is not None:
+            return False
+
+        self._pending = None
+        self._data = future.result()
+        self._resident = pending_keys
+        self._lines = None
+        return True
+
+    def get_data(self) -> MapData:
+        """
+        returns the resident walls as a map, update has to be called first
+        """
+        if self._data is None:
+            raise ValueError("no chunks are resident, call update first")
+        return self._data
+
+    def get_lines(self) -> list[Line]:
+        """
+        returns the resident walls as line objects, a new list every time they change
+        they are only made when asked for, the map from get_data is enough for the game
+        """
+        if self._lines is None:
+            self._lines = self.get_data().lines()
+        return self._lines
+
+    def close(self) -> None:
+        """
+        stops the loader thread
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._pending = None
+
+    def get_cached_bytes(self) -> int:
+        return self._cached_bytes
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="generates a level and writes it as a chunked world")
+    parser.add_argument("output", help="directory to write the world to")
+    parser.add_argument("--level", default="1000x1000",
+                        help="WxH[:seed] of the generated level, or default")
+    parser.add_argument("--cell", type=int, default=64, help="size of a grid cell in world units")
+    parser.add_argument("--tile", type=int, default=32, help="size of a chunk in grid cells")
+    args = parser.parse_args()
+
+    if args.level == "default":
+        grid = levels.DEFAULT
+    else:
+        size, _, seed = args.level.partition(":")
+        grid_w, grid_h = (int(n) for n in size.split("x"))
+        grid = levels.generate(grid_w, grid_h, seed=int(seed or 0))
+    build_world(grid, (args.cell, args.cell), args.output, args.tile)
+
+
+if __name__ == "__main__":
+    main()